@@ -1,12 +1,27 @@
 """Go4Schools API Communication using username and password. By Gabriel Lancaster-West"""
 
-import pickle
+import argparse
+import queue
+import threading
 from abc import ABC
 from datetime import datetime, timedelta, date
 from getpass import getpass
-from json import loads
 from os.path import exists
-
+from time import monotonic
+
+from calendars import (PRIMARY, MANAGED_DESCRIPTION, HOMEWORK_SUBJECT, calendar_name, colours, set_calendar_mode,
+                       get_calendar_mode)
+from instrumentation import metrics
+from profiling import profiler
+from page_parser import extract_fields, page_parse_error, LOGIN_PAGE_PATTERNS, STUDENT_PAGE_PATTERNS
+from homework_index import homework_index
+from ics_export import ics_feed, serve_feed
+from records_store import records_store, export_history
+from recurrence import series_id, merge_series, recurrence_dates, series_with_dates
+from snapshots import snapshot_store
+from sync import sync_events, lesson_jobs, homework_jobs, run_in_background, FINISHED
+from time_zones import DEFAULT_TIME_ZONE, set_time_zone, get_time_zone, local_datetime, local_iso
+from zoneinfo import ZoneInfoNotFoundError
 from useful_functions import *
 
 
@@ -37,6 +52,18 @@ def __parse_config_file(config_file_txt: str) -> None:
     else:
         print(f"[{prefix}] appearance_mode setting not found in '{config_file_txt}'.")
 
+    if config_dict.get("time_zone"):
+        try:
+            set_time_zone(config_dict["time_zone"])
+        except Exception:
+            raise ValueError(f"[{prefix}] time_zone in {config_file_txt} is invalid.")
+
+    if config_dict.get("calendar_mode"):
+        try:
+            set_calendar_mode(config_dict["calendar_mode"])
+        except ValueError:
+            raise ValueError(f"[{prefix}] calendar_mode in {config_file_txt} is invalid.")
+
     if config_dict["appearance_mode"]:
         try:
             ctk.set_default_color_theme(config_dict["default_color_theme"])
@@ -58,20 +85,26 @@ try:
 except ImportError:
     install("customtkinter")
     import customtkinter as ctk
+try:
+    set_time_zone(DEFAULT_TIME_ZONE)
+except ZoneInfoNotFoundError:  # Windows doesn't come with a timezone database
+    install("tzdata")
+    set_time_zone(DEFAULT_TIME_ZONE)
 config_file = "config.txt"
 __parse_config_file(config_file)
 
 try:
     from googleapiclient.discovery import build
     from google_auth_oauthlib.flow import InstalledAppFlow
-    from google.auth.transport.requests import Request
 except ImportError:
     install("google-api-python-client")
     install("google-auth-httplib2")
     install("google-auth-oauthlib")
     from googleapiclient.discovery import build
     from google_auth_oauthlib.flow import InstalledAppFlow
-    from google.auth.transport.requests import Request
+
+from credential_store import credential_store
+from transport import g4s_transport, deadline, transport_error
 
 
 class go4schools_session(object):
@@ -79,25 +112,26 @@ class go4schools_session(object):
     Go4Schools session using username and password, only currently works for students.
     """
 
-    def __init__(self, username: str, password: str):
+    # base URLs, these can be pointed somewhere else (e.g. the local stand-ins in benchmark.py)
+    web_url = "https://www.go4schools.com"
+    api_url = "https://api.go4schools.com"
+    # how long the homework list is reused for before get_homework() fetches it again
+    homework_cache_seconds = 600
+    # Go4Schools' short subject names, and what lessons and homework are called instead
+    subject_names = {"Rg": "Form", "Computer Sci": "Computer Science"}
+
+    def __init__(self, username: str, password: str, request_deadline: deadline = None):
         """Takes in a username and password as parameters and logs into the Go4Schools website using the Requests 
         library. It extracts the student ID and bearer token from the HTML response and stores them as attributes of 
-        the class. """
+        the class. The login gives up with a deadline_exceeded_error if it can't finish before request_deadline. """
         self.prefix = "Go4Schools"
-        login_url = "https://www.go4schools.com/sso/account/login?site=Student"
-        session = requests.Session()
-        response = session.get(login_url)
-        # Parse the CSRF token from the HTML form.
-        csrf_token = response.text.split('name="__RequestVerificationToken" type="hidden" value="')[1].split('"')[0]
-        # Login using the username and password.
-        login_data = {
-            "username": username,
-            "password": password,
-            "__RequestVerificationToken": csrf_token
-        }
-        response = session.post(login_url, data=login_data)
-        # Extract the student ID and bearer token from the HTML.
+        self._homework_index = None
+        self._homework_fetched_at = 0.0
+        # the GUI revalidates in a background thread, so only one thread at a time checks and refills the cache
+        self._homework_lock = threading.Lock()
+        self.transport, response = self._login(username, password, request_deadline)
         if "login" in response.url:
+            response.close()
             raise Exception(
                 "Incorrect Username or Password. Please use Go4Schools_Session.verify_login_details() before "
                 "declaring the class.")
@@ -108,27 +142,40 @@ class go4schools_session(object):
         else:
             self.academic_year = str(now.year)
 
-        self.SchoolID = response.text.split("var s_schoolID = ")[1].split(";")[0]
+        # Extract the school ID, student ID and bearer token from the HTML, in one pass.
+        fields = extract_fields(response, STUDENT_PAGE_PATTERNS, "student home")
+        self.SchoolID = fields["s_schoolID"]
         print(self.SchoolID)
-        self.student_id = response.text.split("?sid=")[1].split('"')[0]
-        self.bearer = "Bearer " + response.text.split("var accessToken = ")[1].split('"')[1]
+        self.student_id = fields["sid"]
+        self.bearer = "Bearer " + fields["accessToken"]
         print(f"[{self.prefix}] Logged in as '{username}' with student ID {self.student_id}.")
 
     @staticmethod
-    def verify_login_details(username, password):
-        """Takes in a username and password and returns True if the login details are valid and False otherwise."""
-        login_url = "https://www.go4schools.com/sso/account/login?site=Student"
-        session = requests.Session()
-        response = session.get(login_url)
+    def _login(username: str, password: str, request_deadline: deadline = None) -> tuple:
+        """
+        Posts the username and password to the Go4Schools login form, and returns the transport (which holds the
+        logged in requests session) and the (streamed, unread) response. If the login failed, the response's URL will
+        still be the login page.
+        """
+        login_url = go4schools_session.web_url + "/sso/account/login?site=Student"
+        transport = g4s_transport()
+        response = transport.get("go4schools.login_page", login_url, request_deadline, stream=True)
         # Parse the CSRF token from the HTML form.
-        csrf_token = response.text.split('name="__RequestVerificationToken" type="hidden" value="')[1].split('"')[0]
+        csrf_token = extract_fields(response, LOGIN_PAGE_PATTERNS, "login")["__RequestVerificationToken"]
         # Login using the username and password.
         login_data = {
             "username": username,
             "password": password,
             "__RequestVerificationToken": csrf_token
         }
-        response = session.post(login_url, data=login_data)
+        response = transport.post("go4schools.login", login_url, request_deadline, data=login_data, stream=True)
+        return transport, response
+
+    @staticmethod
+    def verify_login_details(username, password):
+        """Takes in a username and password and returns True if the login details are valid and False otherwise."""
+        _, response = go4schools_session._login(username, password)
+        response.close()
 
         if "login" in response.url:
             return False  # invalid
@@ -141,10 +188,21 @@ class go4schools_session(object):
         today = datetime.now()
         start_of_week = today - timedelta(days=today.weekday())
         end_of_week = start_of_week + timedelta(days=6, seconds=-1)
-        start_of_week_str = start_of_week.strftime("%a, %d %b %Y 00:00:00 GMT")
-        end_of_week_str = end_of_week.strftime("%a, %d %b %Y 23:59:59 GMT")
 
-        return start_of_week_str, end_of_week_str
+        return go4schools_session.format_date_range(start_of_week, end_of_week)
+
+    @staticmethod
+    def format_date_range(start_date: date, end_date: date) -> tuple:
+        """Formats a start and end date (or datetime) as get_timetable() expects, covering the whole of both days."""
+        return start_date.strftime("%a, %d %b %Y 00:00:00 GMT"), end_date.strftime("%a, %d %b %Y 23:59:59 GMT")
+
+    @classmethod
+    def normalise_subject_names(cls, items: list[dict]) -> list[dict]:
+        """Replaces the weird subject names of lessons or homework tasks (in place), so both use the same names."""
+        for item in items:
+            if item.get("subject_name") in cls.subject_names:
+                item["subject_name"] = cls.subject_names[item["subject_name"]]
+        return items
 
     @staticmethod
     def get_dates_with_console_prompt():
@@ -158,15 +216,15 @@ class go4schools_session(object):
         end_date = input()
         end_date = datetime.strptime(end_date, "%d/%m/%Y").date()
 
-        start_str = start_date.strftime("%a, %d %b %Y 00:00:00 GMT")
-        end_str = end_date.strftime("%a, %d %b %Y 23:59:59 GMT")
-
-        return start_str, end_str
+        return go4schools_session.format_date_range(start_date, end_date)
 
-    def get_timetable(self, start_date: str = None, end_date: str = None) -> list[dict]:
+    def get_timetable(self, start_date: str = None, end_date: str = None,
+                      request_deadline: deadline = None) -> list[dict]:
         """Retrieves the student's timetable for a given start and end date (formatted as "Sat, 1 Jan 2000 00:00:00 
         GMT") from the Go4Schools API. If no dates are specified, it uses the StartEnd_OfWeek method to get the start 
-        and end dates of the current week. The method returns a list of dictionaries representing the lessons. """
+        and end dates of the current week. The method returns a list of dictionaries representing the lessons. 
+        This (and the other get_ methods) raise a transport_error if Go4Schools fails or doesn't respond within the
+        request_deadline. """
         if not (start_date or end_date):
             start_date, end_date = self.start_end_of_week()
 
@@ -177,27 +235,23 @@ class go4schools_session(object):
             "origin": "https://www.go4schools.com",
             "referer": "https://www.go4schools.com/"
         }
-        base_url = "https://api.go4schools.com/web/stars/v1/timetable/student/academic-years/"
+        base_url = self.api_url + "/web/stars/v1/timetable/student/academic-years/"
         timetable_url = base_url + str(
             datetime.now().year) + "/school-id/" + self.SchoolID + "/user-type/1/student-id/" + self.student_id + \
                         "/from-date/ "
         timetable_url += str(start_date) + "/to-date/" + str(end_date) + "?caching=true"
-        response = requests.get(timetable_url, headers=headers)
-        print(f"{self.prefix}: Status code from 'api.go4schools.com':", response.status_code)
-        lessons = loads(response.text)["student_timetable"]
+        lessons = self.transport.get_json("go4schools.timetable", timetable_url, request_deadline,
+                                          headers=headers)["student_timetable"]
 
         # replace all weird names
-        for i in range(len(lessons)):
-            if lessons[i]["subject_name"] == "Rg":
-                lessons[i]["subject_name"] = "Form"
-            elif lessons[i]["subject_name"] == "Computer Sci":
-                lessons[i]["subject_name"] = "Computer Science"
-
-        return lessons
-
-    def get_attendance(self) -> str:
-        """Retrieves the student's attendance data from the Go4Schools API. It returns the attendance data as a 
-        string. """
+        return self.normalise_subject_names(lessons)
+
+    def get_attendance(self, year_group: int = 12, academic_year=None, request_deadline: deadline = None) -> str:
+        """Retrieves the student's attendance data from the Go4Schools API, for a year group and academic year (the
+        year it ends in, e.g. 2024 for 2023/24, defaults to the current one). It returns the attendance data as a 
+        string, records_store.parse_attendance() turns it into records. """
+        if not academic_year:
+            academic_year = self.academic_year
         print(f"{self.prefix}: Fetching attendance...")
 
         headers = {
@@ -205,50 +259,58 @@ class go4schools_session(object):
             "origin": "https://www.go4schools.com",
             "referer": "https://www.go4schools.com/"
         }
-        base_url = "https://api.go4schools.com/web/stars/v1/attendance/session/academic-years/"
-        attendance_url = base_url + str(
-            datetime.now().year) + "/school-id/" + self.SchoolID + "/user-type/1/year-groups/12/student-id/" + \
-                         self.student_id + "?caching=false&includeSettings=true"
-        response = requests.get(attendance_url, headers=headers)
+        base_url = self.api_url + "/web/stars/v1/attendance/session/academic-years/"
+        attendance_url = base_url + str(academic_year) + "/school-id/" + self.SchoolID + "/user-type/1/year-groups/" + \
+                         str(year_group) + "/student-id/" + self.student_id + "?caching=false&includeSettings=true"
+        response = self.transport.get("go4schools.attendance", attendance_url, request_deadline, headers=headers)
         print("Status code:", response.status_code)
         return response.text
 
-    def get_grades(self) -> str:
-        """Gets grades using the Go4Schools API"""
-        url = "https://api.go4schools.com/web/stars/v1/attainment/student-grades/academic-years/" + \
-              self.academic_year + "/school-id/" + self.SchoolID + "/user-type/1/year-group/12/student-id/" \
-              + self.student_id + "?caching=false&includeSettings=false"
+    def get_grades(self, year_group: int = 12, academic_year=None, request_deadline: deadline = None) -> str:
+        """Gets grades using the Go4Schools API, for a year group and academic year (defaults to the current one).
+        Returns the raw response text, records_store.parse_grades() turns it into records."""
+        if not academic_year:
+            academic_year = self.academic_year
+        url = self.api_url + "/web/stars/v1/attainment/student-grades/academic-years/" + \
+              str(academic_year) + "/school-id/" + self.SchoolID + "/user-type/1/year-group/" + str(year_group) + \
+              "/student-id/" + self.student_id + "?caching=false&includeSettings=false"
         headers = {
             "authorization": self.bearer,
             "origin": "https://www.go4schools.com",
             "referer": "https://www.go4schools.com/"
         }
-        response = requests.get(url, headers=headers)
+        response = self.transport.get("go4schools.grades", url, request_deadline, headers=headers)
         print(f"{self.prefix}: Status code:", response.status_code)
         return response.text
 
-    def get_homework(self) -> list[dict]:
-        """Gets homework using the Go4Schools API"""
-        headers = {
-            "authorization": self.bearer,
-            "origin": "https://www.go4schools.com",
-            "referer": "https://www.go4schools.com/"
-        }
-        url = "https://api.go4schools.com/web/stars/v1/homework/student/academic-years/" + self.academic_year + \
-              "/school-id/" + self.SchoolID + "/user-type/1/student-id/" + self.student_id + \
-              "?caching=true&includeSettings=true"
-        response = requests.get(url, headers=headers)
-        homework = loads(response.text)["student_homework"]["homework"]
-
-        future_tasks = []
+    def get_homework_index(self, request_deadline: deadline = None, refresh: bool = False) -> homework_index:
+        """Gets the whole academic year's homework using the Go4Schools API, indexed by due date. The endpoint has no
+        date or paging parameters, so the full list is fetched once and reused for homework_cache_seconds (or until
+        refresh=True), which makes GUI refreshes range lookups instead of downloads."""
+        with self._homework_lock:
+            if not refresh and self._homework_index is not None and \
+                    monotonic() - self._homework_fetched_at < self.homework_cache_seconds:
+                return self._homework_index
+
+            headers = {
+                "authorization": self.bearer,
+                "origin": "https://www.go4schools.com",
+                "referer": "https://www.go4schools.com/"
+            }
+            url = self.api_url + "/web/stars/v1/homework/student/academic-years/" + self.academic_year + \
+                  "/school-id/" + self.SchoolID + "/user-type/1/student-id/" + self.student_id + \
+                  "?caching=true&includeSettings=true"
+            homework = self.transport.get_json("go4schools.homework", url, request_deadline,
+                                               headers=headers)["student_homework"]["homework"]
+            self._homework_index = homework_index(self.normalise_subject_names(homework))
+            self._homework_fetched_at = monotonic()
+            return self._homework_index
+
+    def get_homework(self, request_deadline: deadline = None, refresh: bool = False) -> list[dict]:
+        """Gets homework due from the start of the week onwards (in due date order), see get_homework_index()."""
         today = datetime.now()
         start_of_week = today - timedelta(days=today.weekday() + 1)
-        for task in homework:
-            date_str = task["due_date"]
-            date_str_as_datetime = datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%S')
-            if date_str_as_datetime >= start_of_week:
-                future_tasks.append(task)
-        return future_tasks
+        return self.get_homework_index(request_deadline, refresh).upcoming(start_of_week)
 
 
 class timetable_tab(ctk.CTkTabview, ABC):
@@ -342,12 +404,13 @@ class homework_tab(ctk.CTkTabview, ABC):
                 i += 1
 
             if due_date >= today:
+                # don't overwrite task["due_date"], the tasks are shared with go4schools_session's homework cache
                 if due_date == today:
-                    task["due_date"] = "Today"
+                    due_text = "Today"
                 elif due_date == today + timedelta(days=1):
-                    task["due_date"] = "Tomorrow"
+                    due_text = "Tomorrow"
                 else:
-                    task["due_date"] = due_date.strftime("%A %d %B %Y")
+                    due_text = due_date.strftime("%A %d %B %Y")
                 label = ctk.CTkLabel(self.tab("Homework"), text=("\n\n" + task["title"]))
                 label.configure(text_color="#0CCE6B")
                 label.pack(padx=20, pady=1)
@@ -355,7 +418,7 @@ class homework_tab(ctk.CTkTabview, ABC):
                 label.pack(padx=20, pady=1)
                 label = ctk.CTkLabel(self.tab("Homework"), text=details)
                 label.pack(padx=20, pady=1)
-                label = ctk.CTkLabel(self.tab("Homework"), text=("Due: " + task["due_date"]))
+                label = ctk.CTkLabel(self.tab("Homework"), text=("Due: " + due_text))
                 label.pack(padx=20, pady=1)
                 future_tasks.append(task)
 
@@ -369,10 +432,12 @@ class timetable_and_homework_display(ctk.CTk, ABC):
         super().__init__()
 
         self.title("Timetable and Homework")
-        self.tabview = timetable_tab(root=self, data=lesson_data)
-        self.tabview.grid(row=0, column=0, padx=20, pady=20)
-        self.tabview = homework_tab(root=self, homework_data=homework_data)
-        self.tabview.grid(row=0, column=1, padx=20, pady=20)
+        with profiler.span("gui timetable_tab"):
+            self.tabview = timetable_tab(root=self, data=lesson_data)
+            self.tabview.grid(row=0, column=0, padx=20, pady=20)
+        with profiler.span("gui homework_tab"):
+            self.tabview = homework_tab(root=self, homework_data=homework_data)
+            self.tabview.grid(row=0, column=1, padx=20, pady=20)
 
 
 class google_calendar_session(object):
@@ -382,29 +447,36 @@ class google_calendar_session(object):
     project, therefore the syntax and formatting of parameters may be very strange in other circumstances.
     """
 
-    def __init__(self):
+    def __init__(self, service=None, calendar_mode: str = None):
+        """
+        Logs into Google using credentials.json (and token.pickle if it exists). An already built calendar service
+        can be passed in instead, which skips the login completely (the benchmarks use this).
+        The token is kept fresh in the background by a credential_store, which is safe to share between processes.
+        calendar_mode is where events go (see calendars.py), calendar_mode in config.txt (or "primary") by default.
+        """
         self.prefix = "[Google Calendar]"
-        self.service = None
+        self.service = service
+        self.calendar_mode = calendar_mode or get_calendar_mode()
+        self._events = None
+        self._calendar_ids = None
+        self.credential_store = None
+        if self.service:
+            return
         if exists("credentials.json"):
             scopes = ['https://www.googleapis.com/auth/calendar']
             credentials_file = 'credentials.json'
-            creds = None
             # The file token.pickle stores the user's access and refresh tokens, and is
             # created automatically when the authorization flow completes for the first
-            # time.
-            if exists('token.pickle'):
-                with open('token.pickle', 'rb') as token:
-                    creds = pickle.load(token)
+            # time. The store refreshes them if they have expired.
+            self.credential_store = credential_store('token.pickle')
+            creds = self.credential_store.get_credentials()
             # If there are no (valid) credentials available, let the user log in.
-            if not creds or not creds.valid:
-                if creds and creds.expired and creds.refresh_token:
-                    creds.refresh(Request())
-                else:
-                    flow = InstalledAppFlow.from_client_secrets_file(credentials_file, scopes)
-                    creds = flow.run_local_server(port=0)
+            if not creds:
+                flow = InstalledAppFlow.from_client_secrets_file(credentials_file, scopes)
+                creds = flow.run_local_server(port=0)
                 # Save the credentials for the next run
-                with open('token.pickle', 'wb') as token:
-                    pickle.dump(creds, token)
+                self.credential_store.save(creds)
+            self.credential_store.start_background_refresh(creds)
 
             self.service = build('calendar', 'v3', credentials=creds)
         else:
@@ -414,6 +486,72 @@ class google_calendar_session(object):
                 "generating these credentials can be found at "
                 "https://karenapp.io/articles/how-to-automate-google-calendar-with-python-using-the-calendar-api/")
 
+    @property
+    def events(self):
+        """
+        The calendar's events resource. It is built once and reused, as building it parses the whole discovery
+        document (which took longer than the request itself, and left megabytes of garbage behind every call).
+        """
+        if self._events is None:
+            self._events = self.service.events()
+        return self._events
+
+    def close(self) -> None:
+        """
+        Closes the connection to Google, stops the token refresh thread and lets go of the service, the session can't
+        be used after this.
+        """
+        if self.credential_store is not None:
+            self.credential_store.stop_background_refresh()
+        if self.service is not None:
+            self.service.close()
+        self.service = None
+        self._events = None
+
+    def _managed_calendars(self) -> dict:
+        """{name: ID} of the calendars this app created, read from the user's calendar list once per session."""
+        if self._calendar_ids is None:
+            calendar_ids = {}
+            page_token = None
+            while True:
+                calendar_list = metrics.timed_execute("calendar.calendarList.list",
+                                                      self.service.calendarList().list(pageToken=page_token))
+                for entry in calendar_list.get("items", []):
+                    if entry.get("description") == MANAGED_DESCRIPTION:
+                        calendar_ids[entry["summary"]] = entry["id"]
+                page_token = calendar_list.get("nextPageToken")
+                if not page_token:
+                    break
+            self._calendar_ids = calendar_ids
+        return self._calendar_ids
+
+    def calendar_id(self, subject) -> str:
+        """The ID of the calendar events for a subject go in, the calendar is created if it doesn't exist yet."""
+        if self.calendar_mode == PRIMARY:
+            return "primary"
+        name = calendar_name(self.calendar_mode, subject)
+        calendar_ids = self._managed_calendars()
+        if name not in calendar_ids:
+            calendar = metrics.timed_execute("calendar.calendars.insert", self.service.calendars().insert(
+                body={"summary": name, "description": MANAGED_DESCRIPTION, "timeZone": get_time_zone()}))
+            calendar_ids[name] = calendar["id"]
+            print(f"{self.prefix}: Created Calendar ({name})")
+        return calendar_ids[name]
+
+    def event_calendar_id(self, event_body: dict) -> str:
+        """The ID of the calendar an event body (from timed_event_body() or day_event_body()) goes in."""
+        private = event_body.get("extendedProperties", {}).get("private", {})
+        return self.calendar_id(private.get("g4s_subject", event_body["summary"]))
+
+    def own_calendar_ids(self) -> list[str]:
+        """
+        The calendars this app's events are in, so scans (like remove_duplicate_events()) only look at those. In
+        primary mode that's the whole primary calendar, otherwise every calendar the app has created.
+        """
+        if self.calendar_mode == PRIMARY:
+            return ["primary"]
+        return list(self._managed_calendars().values())
+
     def event_exists(self, event_body: dict) -> bool:
         """
         Checks if an event specified by "eventBody" already exists in the users calendar. This is to prevent duplicates
@@ -424,49 +562,55 @@ class google_calendar_session(object):
 
         I may sort this out at some point because this hard coding is very poor from me.
         """
-        events_result = self.service.events().list(calendarId='primary', timeMin=event_body['start']['dateTime'],
-                                                   timeMax=event_body['end']['dateTime'], singleEvents=True,
-                                                   orderBy='startTime').execute()
+        events_result = metrics.timed_execute("calendar.events.list", self.events.list(
+            calendarId=self.event_calendar_id(event_body), timeMin=event_body['start']['dateTime'],
+            timeMax=event_body['end']['dateTime'], singleEvents=True, orderBy='startTime'))
         for event in events_result.get("items", []):
             if event['summary'] == event_body['summary']:
                 return True
         return False
 
-    def create_event(self, title, description, start, end, time_zone=None):
+    def create_event(self, title, description, start, end, time_zone=None, subject=None):
         """
         Creates an event in the users Google Calendar.
-        Creates this event in the primary calendar, with a colour corresponding to the first character of the title.
+        Creates this event in the calendar for its subject (the title unless given, see calendar_id()), with the
+        subject's colour.
 
-        Defaults to Greenwich timezone, unless specified under the time_zone parameter. Check the Google Calendar API
-        documentation for information on valid timezones.
+        Defaults to the configured timezone (Europe/London, or time_zone in config.txt), unless specified under the
+        time_zone parameter. Check the Google Calendar API documentation for information on valid timezones.
 
-        This will print a "Created Event" or "Event already exists" correspondingly.
+        This will print a "Created Event" or "Event already exists" correspondingly, and return "created" or
+        "skipped".
 
         """
+        event_body = self.timed_event_body(title, description, start, end, time_zone, subject)
 
-        def define_colour(event_title: any) -> str:
-            """
-            Defines colour by the title's first digit. Cycles through 11 possible colours, these correspond to the 11
-            colours available in Google Calendar. Returns a string because I'm lazy.
-            """
-            event_title = str(event_title)  # idk what integer titles ppl be making but yk
-            return str(ord(event_title[0]) % 11 + 1)
+        if not self.event_exists(event_body):
+            self.insert_event(event_body)
+            print(f"{self.prefix}: Created Event  ({title} at {start})")
+            return "created"
+        else:
+            print(f"{self.prefix}: Event already exists  ({title} at {start})")
+            return "skipped"
+
+    @staticmethod
+    def timed_event_body(title, description, start, end, time_zone=None, subject=None) -> dict:
+        """
+        Builds the body of an event for create_event(), see create_event() for what the parameters are. The subject
+        is kept in the event's private extended properties, to pick its calendar.
+        """
+        subject = str(subject or title)  # idk what integer titles ppl be making but yk
 
         # example start:
         # "start": {"dateTime": "2015-09-15T06:00:00+02:00, "timeZone": "Europe/Zurich"},
 
         if not time_zone:
-            time_zone = "Greenwich"
+            time_zone = get_time_zone()
 
-        event_body = {"summary": title, "description": description, "colorId": define_colour(title),
-                      "start": {"dateTime": start, "timeZone": time_zone},
-                      "end": {"dateTime": end, "timeZone": time_zone}}
-
-        if not self.event_exists(event_body):
-            self.service.events().insert(calendarId='primary', body=event_body).execute()
-            print(f"{self.prefix}: Created Event  ({title} at {start})")
-        else:
-            print(f"{self.prefix}: Event already exists  ({title} at {start})")
+        return {"summary": title, "description": description, "colorId": colours.colour(subject),
+                "start": {"dateTime": start, "timeZone": time_zone},
+                "end": {"dateTime": end, "timeZone": time_zone},
+                "extendedProperties": {"private": {"g4s_subject": subject}}}
 
     def day_event_exists(self, event_body: dict) -> bool:
         """
@@ -482,61 +626,180 @@ class google_calendar_session(object):
 
         # eventBody example: eventBody = {"summary": title,"description": description,"colorId": DefineColour(title),
         # "start": {"dateTime": start, "timeZone": 'Greenwich'},"end": {"dateTime": end, "timeZone": 'Greenwich'}}
-        # events_result = self.service.events().list(calendarId='primary', timeMin=eventBody['start']['date'],
+        # events_result = self.events.list(calendarId='primary', timeMin=eventBody['start']['date'],
         #                                           timeMax=eventBody['end']['date'], singleEvents=True,
         #                                           orderBy='startTime').execute()
 
         now = datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
-        events_result = self.service.events().list(
-            calendarId='primary', timeMin=now,
+        events_result = metrics.timed_execute("calendar.events.list", self.events.list(
+            calendarId=self.event_calendar_id(event_body), timeMin=now,
             maxResults=10, singleEvents=True,
-            orderBy='startTime').execute()
+            orderBy='startTime'))
         events = events_result.get('items', [])
         for event in events:
             if event['summary'] == event_body['summary']:
                 return True
         return False
 
-    def create_day_event(self, title, description, start, end):
+    def create_day_event(self, title, description, start, end, subject=None):
         """
         Creates a full day event in the users Google Calendar.
-        Creates this event in the primary calendar, with a colour corresponding to the first character of the title.
+        Creates this event in the calendar for its subject ("Homework" unless given, see calendar_id()), with the
+        subject's colour.
 
-        This will print a "Created Event" or "Event already exists" correspondingly.
+        This will print a "Created Event" or "Event already exists" correspondingly, and return "created" or
+        "skipped".
         """
+        event_body = self.day_event_body(title, description, start, end, subject)
 
-        def define_color(event_title) -> str:
-            """
-            Defines colour by the title's first digit. Cycles through 11 possible colours, these correspond to the 11
-            colours available in Google Calendar. event_title must be mutable.
-            """
-            event_title = str(event_title)
-            return str((ord(event_title[0]) % 11) + 1)
+        if not self.day_event_exists(event_body):
+            self.insert_event(event_body)
+            print(f"{self.prefix}: Created Event ({title} at {start})")
+            return "created"
+        else:
+            print(f"{self.prefix}: Event already exists ({title} at {start})")
+            return "skipped"
 
-        event_body = {
+    @staticmethod
+    def day_event_body(title, description, start, end, subject=None) -> dict:
+        """
+        Builds the body of a full day event for create_day_event(), start and end are dates ('%Y-%m-%d').
+        """
+        subject = str(subject or HOMEWORK_SUBJECT)
+        return {
             "summary": title,
             "description": description,
-            "colorId": define_color(title),
+            "colorId": colours.colour(subject),
             "start": {
                 "date": start,
             },
             "end": {
                 "date": end,
             },
+            "extendedProperties": {
+                "private": {"g4s_subject": subject},
+            },
         }
 
-        if not self.day_event_exists(event_body):
-            self.service.events().insert(calendarId='primary', body=event_body).execute()
-            print(f"{self.prefix}: Created Event ({title} at {start})")
-        else:
-            print(f"{self.prefix}: Event already exists ({title} at {start})")
+    def event_body_exists(self, event_body: dict) -> bool:
+        """Checks if an event built by timed_event_body() or day_event_body() already exists."""
+        if "date" in event_body["start"]:
+            return self.day_event_exists(event_body)
+        return self.event_exists(event_body)
+
+    def insert_event(self, event_body: dict) -> None:
+        """Inserts an already built event body into its calendar, without checking if it exists."""
+        metrics.timed_execute("calendar.events.insert",
+                              self.events.insert(calendarId=self.event_calendar_id(event_body), body=event_body))
 
-    def create_event_from_lessons(self, data: list[dict]) -> None:
+    def create_event_from_lessons(self, data: list[dict], recurring: bool = False) -> None:
         """
         Creates events from a list of lessons using the create_event_from_lesson_singular() method.
+        If recurring is True, lessons which repeat every week are created as one recurring event each instead (see
+        create_recurring_event_from_series()), which is a lot fewer API calls for long timetables.
+        """
+        for progress in sync_events(lesson_jobs(self, data, recurring)):
+            if progress.error:
+                print(f"{self.prefix}: {progress.kind.capitalize()} ({progress.title}): {progress.error}")
+        metrics.print_summary()
+
+    def find_recurring_event(self, event_series_id: str, calendar_id: str = "primary"):
+        """
+        Returns the recurring event already created for a series (or None), using the series ID stored in the event's
+        private extended properties, so only that one event is ever fetched.
+        """
+        events_result = metrics.timed_execute("calendar.events.list", self.events.list(
+            calendarId=calendar_id, privateExtendedProperty=f"g4s_series={event_series_id}", maxResults=1))
+        items = events_result.get("items")
+        return items[0] if items else None
+
+    def single_lesson_dates(self, series: dict, title: str, calendar_id: str) -> set:
+        """
+        The dates of a series which already have a single (not recurring) event for the lesson, e.g. written by a
+        sync from before recurring events were turned on, so the series can leave those weeks out instead of doubling
+        them.
+        """
+        lesson = series["lesson"]
+        starts = {local_datetime(day.isoformat(), lesson["start_time"]): day for day in series["dates"]}
+        time_min = min(starts).isoformat()
+        time_max = local_iso(series["dates"][-1].isoformat(), lesson["end_time"])
+        found = set()
+        page_token = None
+        while True:
+            events_result = metrics.timed_execute("calendar.events.list", self.events.list(
+                calendarId=calendar_id, timeMin=time_min, timeMax=time_max, singleEvents=True, pageToken=page_token))
+            for event in events_result.get("items", []):
+                event_start = event.get("start", {}).get("dateTime")
+                if event.get("recurringEventId") or event.get("recurrence") or event.get("summary") != title or \
+                        not event_start:
+                    continue
+                day = starts.get(datetime.fromisoformat(event_start))
+                if day is not None:
+                    found.add(day)
+            page_token = events_result.get("nextPageToken")
+            if not page_token:
+                break
+        return found
+
+    def create_recurring_event_from_series(self, series: dict, time_zone=None):
+        """
+        Creates a weekly recurring event from a series made by recurrence.compress_weekly_lessons(). Weeks where the
+        lesson doesn't happen (or happens somewhere else, those are created as single events) are excluded with an
+        EXDATE.
+
+        A lesson only ever gets one recurring event. If an earlier sync (of any range) already wrote it, the weeks
+        that sync found outside this one's range are kept and the event is patched ("updated"), or left alone if
+        nothing changed ("skipped"). Weeks which already have a single event for the lesson are left out of the
+        series.
         """
-        for lesson in data:
-            self.create_event_from_lesson_singular(lesson)
+        if not time_zone:
+            time_zone = get_time_zone()
+
+        subject_name = series["lesson"]["subject_name"]
+        calendar_id = self.calendar_id(str(subject_name))
+        event_series_id = series_id(series)
+        existing = self.find_recurring_event(event_series_id, calendar_id)
+        existing_dates = []
+        if existing is not None:
+            existing_dates = recurrence_dates(date.fromisoformat(existing["start"]["dateTime"][:10]),
+                                              existing.get("recurrence", []))
+            series = merge_series(series, existing_dates)
+
+        singles = self.single_lesson_dates(series, subject_name, calendar_id)
+        if singles:
+            dates = [day for day in series["dates"] if day not in singles]
+            if not dates:
+                print(f"{self.prefix}: Lessons already exist as single events  ({subject_name})")
+                return "skipped"
+            series = series_with_dates(series, dates)
+
+        lesson = series["lesson"]
+        subject_name, description, start, end = self.lesson_event_fields(lesson)
+        if existing is not None and series["dates"] == existing_dates:
+            print(f"{self.prefix}: Recurring Event already exists  ({subject_name} at {start})")
+            return "skipped"
+
+        # the RRULE repeats in time_zone, so lessons keep their wall clock time either side of the clocks changing
+        start_time = lesson["start_time"].replace(":", "") + "00"
+        recurrence = [f"RRULE:FREQ=WEEKLY;UNTIL={series['dates'][-1].strftime('%Y%m%d')}T235959Z"]
+        if series["exdates"]:
+            recurrence.append(f"EXDATE;TZID={time_zone}:" + ",".join(
+                exdate.strftime("%Y%m%d") + "T" + start_time for exdate in series["exdates"]))
+
+        event_body = self.timed_event_body(subject_name, description, start, end, time_zone)
+        event_body["recurrence"] = recurrence
+        event_body["extendedProperties"]["private"]["g4s_series"] = event_series_id
+
+        if existing is None:
+            self.insert_event(event_body)
+            print(f"{self.prefix}: Created Recurring Event  ({subject_name} at {start}, {len(series['dates'])} weeks)")
+            return "created"
+
+        metrics.timed_execute("calendar.events.patch", self.events.patch(
+            calendarId=calendar_id, eventId=existing["id"],
+            body={key: event_body[key] for key in ("start", "end", "recurrence", "extendedProperties")}))
+        print(f"{self.prefix}: Updated Recurring Event  ({subject_name} at {start}, {len(series['dates'])} weeks)")
+        return "updated"
 
     def create_event_from_lesson_singular(self, lesson: dict):
         """
@@ -548,14 +811,27 @@ class google_calendar_session(object):
         - lesson["group_code"]
         - lesson["teacher_list"]
         - lesson["room_list"]
+        Returns "created" or "skipped" (free periods are always skipped).
         """
+        if lesson["subject_name"] in ["None", None]:
+            return "skipped"
+        return self.create_event(*self.lesson_event_fields(lesson))
+
+    @staticmethod
+    def lesson_event_fields(lesson: dict) -> tuple:
+        """The (title, description, start, end) of a lesson's event, see create_event_from_lesson_singular()."""
         subject_name = lesson["subject_name"]
-        if subject_name not in ["None", None]:
-            start = lesson["date"][:-8] + lesson["start_time"] + ":00+00:00"
-            end = lesson["date"][:-8] + lesson["end_time"] + ":00+00:00"
-            description = lesson["group_code"] + "\n" + lesson["teacher_list"][
-                list(lesson["teacher_list"].keys())[0]] + "\n" + lesson["room_list"]
-            self.create_event(subject_name, description, start, end)
+        start = local_iso(lesson["date"], lesson["start_time"])
+        end = local_iso(lesson["date"], lesson["end_time"])
+        description = lesson["group_code"] + "\n" + lesson["teacher_list"][
+            list(lesson["teacher_list"].keys())[0]] + "\n" + lesson["room_list"]
+        return subject_name, description, start, end
+
+    def lesson_event_body(self, lesson: dict):
+        """The event body for a lesson, or None for free periods."""
+        if lesson["subject_name"] in ["None", None]:
+            return None
+        return self.timed_event_body(*self.lesson_event_fields(lesson))
 
     def create_event_from_homework_singular(self, task: dict):
         """
@@ -563,8 +839,13 @@ class google_calendar_session(object):
         - task["title"]
         - task["details"]
         - task["due_date"] (which must be in the format '%Y-%m-%dT%H:%M:%S')
+        and optionally task["subject_name"], for its colour and calendar.
         """
+        return self.create_day_event(*self.homework_event_fields(task), subject=task.get("subject_name"))
 
+    @staticmethod
+    def homework_event_fields(task: dict) -> tuple:
+        """The (title, description, start, end) of a homework task's full day event."""
         title = task["title"]
         description = task["details"].replace("\\r\\", "\n")
         due_date = task["due_date"]
@@ -572,15 +853,21 @@ class google_calendar_session(object):
         next_date = due_date_as_datetime + timedelta(days=1)
         due_date_as_datetime = due_date_as_datetime.strftime('%Y-%m-%d')
         next_date = next_date.strftime('%Y-%m-%d')
-        self.create_day_event(title, description, due_date_as_datetime, next_date)
+        return title, description, due_date_as_datetime, next_date
+
+    def homework_event_body(self, task: dict) -> dict:
+        """The full day event body for a homework task."""
+        return self.day_event_body(*self.homework_event_fields(task), subject=task.get("subject_name"))
 
     def create_event_from_homework(self, data: list[dict]):
         """
         Creates Google Calendar events for multiple homework events using the create_event_from_homework_singular()
         method.
         """
-        for task in data:
-            self.create_event_from_homework_singular(task)
+        for progress in sync_events(homework_jobs(self, data)):
+            if progress.error:
+                print(f"{self.prefix}: {progress.kind.capitalize()} ({progress.title}): {progress.error}")
+        metrics.print_summary()
 
     def remove_duplicate_events(self):
         """
@@ -588,32 +875,38 @@ class google_calendar_session(object):
         Kind of works, it might randomly glitch out with double lessons though :/ sorry
         """
 
-        # Retrieve all events from the calendar
-        events_result = self.service.events().list(calendarId='primary', maxResults=2500).execute()
-        events = events_result.get('items', [])
+        metrics.begin_sync()
+        # only the app's own calendars are scanned (unless it's using the primary calendar)
+        for calendar_id in self.own_calendar_ids():
+            # Retrieve all events from the calendar
+            events_result = metrics.timed_execute("calendar.events.list",
+                                                  self.events.list(calendarId=calendar_id, maxResults=2500))
+            events = events_result.get('items', [])
 
-        # Create a set to store unique event summaries and start dates
-        unique_events = set()
+            # Create a set to store unique event summaries and start dates
+            unique_events = set()
 
-        # Loop through each event and check for duplicates
-        for event in events:
-            # Extract the summary and start date of the event
-            try:
-                summary = event['summary']
-                start = event['start'].get('date', event['start'].get('dateTime')).split('T')[0]
+            # Loop through each event and check for duplicates
+            for event in events:
+                # Extract the summary and start date of the event
+                try:
+                    summary = event['summary']
+                    start = event['start'].get('date', event['start'].get('dateTime')).split('T')[0]
 
-                # If the event is a duplicate, delete it
-                if (summary, start) in unique_events:
-                    self.service.events().delete(calendarId='primary', eventId=event['id']).execute()
-                    print(f"Deleted duplicate event '{summary}' on {start}")
-                else:
-                    # Otherwise, add the event to the set of unique events
-                    unique_events.add((summary, start))
+                    # If the event is a duplicate, delete it
+                    if (summary, start) in unique_events:
+                        metrics.timed_execute("calendar.events.delete",
+                                              self.events.delete(calendarId=calendar_id, eventId=event['id']))
+                        print(f"Deleted duplicate event '{summary}' on {start}")
+                    else:
+                        # Otherwise, add the event to the set of unique events
+                        unique_events.add((summary, start))
 
-            except Exception as error:
-                print(f"{event}\n\n{error}")
+                except Exception as error:
+                    print(f"{event}\n\n{error}")
 
         print(f"{self.prefix} Duplicate events removed.")
+        metrics.print_summary()
 
 
 def main_menu(g4s=None):
@@ -627,7 +920,8 @@ def main_menu(g4s=None):
         g4s = go4schools_session(__username, __password)
 
     choices = {"1": "View Timetable and Homework Details", "2": "Add Current Week's Timetable to Google Calendar",
-               "3": "Add Homework to Google Calendar"}
+               "3": "Add Homework to Google Calendar", "4": "Export Timetable and Homework to an .ics File",
+               "5": "Export Grades and Attendance History to a Local Database"}
     valid = False
 
     choice = ""
@@ -650,7 +944,7 @@ def main_menu(g4s=None):
             start, end = g4s.start_end_of_week()
 
         lesson_data = g4s.get_timetable(start, end)
-        homework_data = g4s.GetHomework()
+        homework_data = g4s.get_homework()
         app = timetable_and_homework_display(lesson_data, homework_data)
         app.mainloop()
 
@@ -667,12 +961,38 @@ def main_menu(g4s=None):
                 print("Getting dates from the start and end of current week...")
                 start, end = g4s.start_end_of_week()
             lesson_data = g4s.get_timetable(start, end)
-            google_session.create_event_from_lessons(lesson_data)
+            recurring = input("Add weekly lessons as recurring events? (y/n) ").strip().lower() == "y"
+            google_session.create_event_from_lessons(lesson_data, recurring)
 
         elif choice == "3":
-            homework_data = g4s.GetHomework()
+            homework_data = g4s.get_homework()
             google_session.create_event_from_homework(homework_data)
 
+    elif choice == "4":
+        print("Timetable Export Options:\n1) From start to end of current week\n2) Custom start & end dates")
+        start_end_choice = input()
+        if start_end_choice == "2":
+            start, end = g4s.get_dates_with_console_prompt()
+        else:
+            start, end = g4s.start_end_of_week()
+        feed = ics_feed()
+        date_format = "%a, %d %b %Y %H:%M:%S GMT"  # see format_date_range()
+        feed.update(g4s.get_timetable(start, end), g4s.get_homework(), datetime.strptime(start, date_format),
+                    datetime.strptime(end, date_format))
+        if input("Serve it as a calendar subscription at http://localhost:8000/calendar.ics? (y/n) ").lower() == "y":
+            server = serve_feed(feed.path)
+            input("Press enter to stop serving.")
+            server.shutdown()
+
+    elif choice == "5":
+        current_year_group = int(input("Current year group (e.g. 12): "))
+        number_of_years = int(input("How many academic years back (including this one)? "))
+        current_academic_year = int(g4s.academic_year)
+        years = {current_academic_year - i: current_year_group - i for i in range(number_of_years)}
+        store = records_store()
+        export_history(g4s, store, years)
+        store.close()
+
     main_menu(g4s)
 
 
@@ -684,6 +1004,10 @@ class GUI(ctk.CTk, ABC):
     their Google Calendar, or adding their homework to their Google Calendar. These buttons all point to corresponding
     windows, however I haven't added a "Return to Main Menu" button to any of them yet, so you do just have to restart
     to do multiple things.
+
+    If a timetable was fetched before, the GUI opens straight onto this week's timetable and homework from the saved
+    snapshot (see snapshots.py), without touching the network, and the login window is a button away. The Google
+    session is only created (and OAuth only run) once a calendar action needs it.
     """
 
     def __init__(self, g4s: go4schools_session = None, google_session: google_calendar_session = None):
@@ -691,6 +1015,7 @@ class GUI(ctk.CTk, ABC):
 
         self.GoogleSession = google_session
         self.G4S = g4s
+        self.snapshot = snapshot_store()
         self.startDate_textBox = None
         self.endDate_textBox = None
         self.startDate = None
@@ -699,6 +1024,37 @@ class GUI(ctk.CTk, ABC):
         self.redirect_flag = None
         self.lessonData = None
         self.homeworkData = None
+        self.window_generation = 0  # goes up every time the window is cleared, so late callbacks know to give up
+        # held while something is using the Google session, which (like httplib2) isn't thread safe
+        self.google_busy = threading.Lock()
+
+        if self.G4S:
+            self.snapshot.set_student(self.G4S.student_id)
+        elif self.snapshot.exists():
+            self.display_snapshot()
+        else:
+            self.login_window()
+
+    def get_google_session(self) -> google_calendar_session:
+        """The Google Calendar session, logging into Google the first time it's needed."""
+        if not self.GoogleSession:
+            self.GoogleSession = google_calendar_session()
+        return self.GoogleSession
+
+    def display_snapshot(self):
+        """Shows this week's timetable and homework from the snapshot, without logging in."""
+        today = datetime.now()
+        start_of_week = today - timedelta(days=today.weekday())
+        self.startDate = start_of_week.replace(hour=0, minute=0, second=0)
+        self.endDate = (start_of_week + timedelta(days=6)).replace(hour=23, minute=59, second=59)
+        self.clear_window()
+        self.display_timetable_and_homework()
+
+    def login_window(self):
+        """
+        The login window, if the details are valid it carries on to the main menu. If Go4Schools can't be reached
+        and there is a snapshot, the user can look at that instead.
+        """
 
         def submit_login_details():
             """
@@ -709,40 +1065,48 @@ class GUI(ctk.CTk, ABC):
             self.login_attempts += 1
             __username = self.username_box.get()
             __password = self.password_box.get()
-            if go4schools_session.verify_login_details(__username, __password):
-                self.G4S = go4schools_session(__username, __password)
-                self.main_menu()
-            else:
-                self.is_correct_text.configure(text=f"Incorrect username or password. Attempts: {self.login_attempts}")
-
-        if not self.G4S:
-            self.title("Login")
+            try:
+                if go4schools_session.verify_login_details(__username, __password):
+                    self.G4S = go4schools_session(__username, __password)
+                    self.snapshot.set_student(self.G4S.student_id)
+                    self.main_menu()
+                else:
+                    self.is_correct_text.configure(
+                        text=f"Incorrect username or password. Attempts: {self.login_attempts}")
+            except (transport_error, requests.RequestException, page_parse_error) as error:
+                print(f"[GUI] Couldn't log in: {error}")
+                self.is_correct_text.configure(text="Couldn't reach Go4Schools, check your internet connection.")
+                if self.snapshot.exists():
+                    offline_button = ctk.CTkButton(self, text="View Saved Timetable & Homework",
+                                                   command=self.display_snapshot)
+                    offline_button.grid(column=0, row=5, padx=20, pady=10)
 
-            title_label = ctk.CTkLabel(self, text="\nLogin", font=("Aharoni", 20, "bold"))
-            title_label.grid(column=0, row=0)
+        self.clear_window()
+        self.title("Login")
 
-            self.username_box = ctk.CTkEntry(self, placeholder_text="Username", width=400)
-            self.username_box.grid(column=0, row=1, padx=20, pady=20)
+        title_label = ctk.CTkLabel(self, text="\nLogin", font=("Aharoni", 20, "bold"))
+        title_label.grid(column=0, row=0)
 
-            self.password_box = ctk.CTkEntry(self, placeholder_text="Password", show="•", width=400)
-            self.password_box.grid(column=0, row=2, padx=20, pady=1)
+        self.username_box = ctk.CTkEntry(self, placeholder_text="Username", width=400)
+        self.username_box.grid(column=0, row=1, padx=20, pady=20)
 
-            self.submit_login_button = ctk.CTkButton(self, text="Submit", command=submit_login_details)
-            self.submit_login_button.grid(column=0, row=3, padx=20, pady=20)
+        self.password_box = ctk.CTkEntry(self, placeholder_text="Password", show="•", width=400)
+        self.password_box.grid(column=0, row=2, padx=20, pady=1)
 
-            self.is_correct_text = ctk.CTkLabel(self, text="", text_color="red")
-            self.is_correct_text.grid(column=0, row=4, padx=20, pady=20)
+        self.submit_login_button = ctk.CTkButton(self, text="Submit", command=submit_login_details)
+        self.submit_login_button.grid(column=0, row=3, padx=20, pady=20)
 
-        if not self.GoogleSession:
-            self.GoogleSession = google_calendar_session()
+        self.is_correct_text = ctk.CTkLabel(self, text="", text_color="red")
+        self.is_correct_text.grid(column=0, row=4, padx=20, pady=20)
 
     def main_menu(self):
         """
-        Menu which displays 3 fairly self explaining buttons:
+        Menu which displays 4 fairly self explaining buttons:
         - Display timetable and Homework, which opens a prompt asking the user for the dates they would like to view.
         - Add timetable to calendar, which also opens a prompt asking the user for the dates they would like added to
         their Google Calendar.
         - Add homework to calendar, which does what it says.
+        - Export to .ics, which also asks for dates, then writes them (and the homework) to an .ics file.
         """
         self.clear_window()
         self.title("Main Menu")
@@ -758,6 +1122,10 @@ class GUI(ctk.CTk, ABC):
         def __menu_option_3_command():
             self.add_homework_to_calendar()
 
+        def __menu_option_4_command():
+            self.redirect_flag = "export_to_ics"
+            self.date_selector()
+
         main_text = ctk.CTkLabel(self, text="Main Menu\n\n", font=("Aharoni", 20, "bold", "underline"))
         main_text.grid(row=0, column=1, padx=40, pady=20)
 
@@ -782,10 +1150,18 @@ class GUI(ctk.CTk, ABC):
                                 command=__menu_option_3_command)
         option3.grid(row=3, column=0, padx=40, pady=20)
 
+        tab4 = ctk.CTkTabview(self)
+        tab4.add(name="Export to .ics File")
+        tab4.grid(row=1, column=3, padx=40, pady=20, sticky="nsew")
+        option4 = ctk.CTkButton(tab4, text="Export Timetable & Homework to .ics",
+                                command=__menu_option_4_command)
+        option4.grid(row=3, column=0, padx=40, pady=20)
+
     def clear_window(self):
         """
         Clears customtkinter window, by destroying all child widgets of the window.
         """
+        self.window_generation += 1
         for child in self.winfo_children():
             child.destroy()
 
@@ -820,6 +1196,8 @@ class GUI(ctk.CTk, ABC):
                 self.display_timetable_and_homework()
             elif self.redirect_flag == "add_timetable_to_calendar":
                 self.add_timetable_to_calendar()
+            elif self.redirect_flag == "export_to_ics":
+                self.export_to_ics()
 
         self.clear_window()
         self.title("Date Selector")
@@ -833,13 +1211,17 @@ class GUI(ctk.CTk, ABC):
         submit_button = ctk.CTkButton(self, text="Submit Dates", command=submit_dates_button)
         submit_button.grid(row=2, column=0, padx=40, pady=20)
 
-    def display_timetable_and_homework(self):
+    def display_timetable_and_homework(self, revalidate: bool = True):
         """
         Makes a customtkinter window which displays the users timetable and homework.
         The timetable start and end date have already been chosen in the date_selector method, which are then stored
         in self.startDate and self.endDate.
         There is also a button to view the week after that, because its really annoying retyping everything to view the
         next date.
+
+        The timetable and homework are drawn from the snapshot straight away. When logged in they are then fetched
+        again in the background (see revalidate_snapshot()), unless nothing was saved for these dates yet, in which
+        case they are fetched first.
         """
 
         self.title("Go4Schools GUI")
@@ -852,18 +1234,89 @@ class GUI(ctk.CTk, ABC):
             suffix = 'th' if 11 <= day <= 13 else {1: 'st', 2: 'nd', 3: 'rd'}.get(day % 10, 'th')
             return dt.strftime(f"%d{suffix} of %B %Y")
 
-        lesson_data = self.G4S.get_timetable(self.startDate - timedelta(days=1),
-                                             self.endDate)  # not sure why I have to take away a day
-        homework_data = self.G4S.get_homework()
+        status = ""
+        if self.G4S and not self.snapshot.covers(self.startDate, self.endDate):
+            revalidate = False
+            try:
+                self.refresh_snapshot(self.startDate, self.endDate)
+            except (transport_error, requests.RequestException) as error:
+                print(f"[GUI] Couldn't fetch the timetable: {error}")
+                status = "Couldn't reach Go4Schools, and nothing was saved for these dates."
+        elif not self.G4S:
+            saved_at = self.snapshot.saved_at
+            status = f"Offline, showing what was saved {saved_at:%d/%m/%Y at %H:%M}." if saved_at else "Offline."
+            if not self.snapshot.covers(self.startDate, self.endDate):
+                status += " Nothing was saved for these dates."
+
+        lesson_data = self.snapshot.lessons_between(self.startDate, self.endDate)
+        homework_data = self.snapshot.homework()
         week_starting_label = ctk.CTkLabel(self, text=f"Week Starting {format_date(self.startDate)}",
                                            font=("Aharoni", 20, "bold"))
         week_starting_label.grid(row=0, column=0, padx=30, pady=30)
         next_week_button = ctk.CTkButton(self, text="View Next Week", command=self.increment_dates)
         next_week_button.grid(row=0, column=1, pady=20)
-        tabview = timetable_tab(root=self, data=lesson_data)
-        tabview.grid(row=1, column=0, padx=20, pady=20, sticky="nw")
-        tabview = homework_tab(root=self, homework_data=homework_data)
-        tabview.grid(row=1, column=1, padx=20, pady=20, sticky="ne")
+        with profiler.span("gui timetable_tab"):
+            tabview = timetable_tab(root=self, data=lesson_data)
+            tabview.grid(row=1, column=0, padx=20, pady=20, sticky="nw")
+        with profiler.span("gui homework_tab"):
+            tabview = homework_tab(root=self, homework_data=homework_data)
+            tabview.grid(row=1, column=1, padx=20, pady=20, sticky="ne")
+
+        status_label = ctk.CTkLabel(self, text=status)
+        status_label.grid(row=2, column=0, padx=20, pady=10, sticky="w")
+        if not self.G4S:
+            login_button = ctk.CTkButton(self, text="Log In to Refresh", command=self.login_window)
+            login_button.grid(row=2, column=1, pady=10)
+        elif revalidate:
+            status_label.configure(text="Checking for changes...")
+            self.revalidate_snapshot(lesson_data, homework_data, status_label)
+
+    def refresh_snapshot(self, start: datetime, end: datetime):
+        """
+        Fetches the timetable for start to end, and the homework, and saves them to the snapshot. The homework comes
+        from the cached index, so it's only downloaded again once it's homework_cache_seconds old, not every time a
+        week is shown.
+        """
+        lessons = self.G4S.get_timetable(*self.G4S.format_date_range(start, end))
+        self.snapshot.save_timetable(lessons, start, end)
+        self.snapshot.save_homework(self.G4S.get_homework())
+
+    def revalidate_snapshot(self, shown_lessons: list[dict], shown_homework: list[dict], status_label: ctk.CTkLabel):
+        """
+        Refreshes the snapshot for the dates on screen in a background thread, then redraws the window if anything
+        changed. Gives up quietly if the user has moved on to another window by then.
+        """
+        generation = self.window_generation
+        start, end = self.startDate, self.endDate
+        results = queue.Queue()
+
+        def refresh():
+            try:
+                self.refresh_snapshot(start, end)
+                results.put(None)
+            except Exception as error:
+                results.put(error)
+
+        def poll():
+            if generation != self.window_generation:
+                return
+            try:
+                error = results.get_nowait()
+            except queue.Empty:
+                self.after(100, poll)
+                return
+            if error:
+                print(f"[GUI] Couldn't refresh the timetable: {error}")
+                status_label.configure(text="Couldn't reach Go4Schools, showing the saved timetable.")
+            elif (self.snapshot.lessons_between(start, end) != shown_lessons
+                  or self.snapshot.homework() != shown_homework):
+                self.clear_window()
+                self.display_timetable_and_homework(revalidate=False)
+            else:
+                status_label.configure(text="Up to date.")
+
+        threading.Thread(target=refresh, daemon=True).start()
+        self.after(100, poll)
 
     def increment_dates(self):
         """
@@ -875,6 +1328,52 @@ class GUI(ctk.CTk, ABC):
         self.clear_window()
         self.display_timetable_and_homework()
 
+    def follow_sync_progress(self, jobs: list[tuple], progress_bar: ctk.CTkProgressBar, status_label: ctk.CTkLabel,
+                             busy_buttons: tuple = ()) -> bool:
+        """
+        Runs a sync (see sync.sync_events()) in a background thread, and polls its progress events every 100ms to
+        update the progress bar and status label. The sync itself never waits for the GUI to repaint.
+
+        The sync holds google_busy until it finishes, so nothing else uses the Google session at the same time, and
+        busy_buttons are disabled until then. Returns False (without syncing) if another sync is still running.
+        """
+        if not self.google_busy.acquire(blocking=False):
+            status_label.configure(text="Another sync is still running, try again once it has finished.")
+            return False
+        for busy_button in busy_buttons:
+            busy_button.configure(state="disabled")
+
+        def sync():
+            try:
+                yield from sync_events(jobs)
+            finally:
+                self.google_busy.release()
+
+        events_queue = run_in_background(sync())
+
+        def poll():
+            latest = None
+            while not events_queue.empty():
+                latest = events_queue.get_nowait()
+                if latest.error:
+                    print(f"[GUI] {latest.kind.capitalize()} ({latest.title}): {latest.error}")
+            if latest is not None:
+                progress_bar.set(latest.fraction)
+                counts = ", ".join(f"{kind} {count}" for kind, count in latest.counts.items() if count)
+                eta = f" - about {latest.eta:.0f}s left" if latest.eta else ""
+                status_label.configure(text=f"{latest.done}/{latest.total} {counts}{eta}")
+            if latest is not None and latest.kind == FINISHED:
+                status_label.configure(text=f"Done! {latest.done}/{latest.total} {counts}")
+                for busy_button in busy_buttons:
+                    if busy_button.winfo_exists():
+                        busy_button.configure(state="normal")
+                metrics.print_summary()
+            else:
+                progress_bar.after(100, poll)
+
+        poll()
+        return True
+
     def add_timetable_to_calendar(self):
         """
         Adds the users' timetable to their Google Calendar. The dates for this have already been selected by the
@@ -885,33 +1384,11 @@ class GUI(ctk.CTk, ABC):
 
         def add_lesson_to_calendar():
             """
-            Adds lesson to Google calendar. I'm not sure that I need the update_progress method, I might just be
-            able to demote it, but I'm scared it will all shatter apart, getting the progress bar working was so
-            painful.
+            Adds lessons to Google calendar in the background, see follow_sync_progress().
             """
-            number_of_lessons = len(self.lessonData)
-            progress = 0
-
-            def update_progress():
-                """
-                !!!Generated by ChatGPT
-                Genuine witchcraft don't contact me asking how this works;
-                It uses nonlocal functions to update a progress bar. It's so complicated to prevent a bug
-                to do with customtkinter hogging all Pythons processing, which doesn't let the progress bar be
-                updated.
-                """
-                nonlocal progress
-                try:
-                    lesson = next(lesson_generator)
-                    self.GoogleSession.create_event_from_lesson_singular(lesson)
-                    progress += 1
-                    progress_bar.set(progress / number_of_lessons)
-                    progress_bar.after(100, update_progress)
-                except StopIteration:
-                    pass
-
-            lesson_generator = (lesson for lesson in self.lessonData)
-            update_progress()
+            jobs = lesson_jobs(self.get_google_session(), self.lessonData, bool(recurring_checkbox.get()))
+            if self.follow_sync_progress(jobs, progress_bar, status_label):
+                button.configure(state="disabled")
 
         self.clear_window()
 
@@ -922,11 +1399,18 @@ class GUI(ctk.CTk, ABC):
         progress_bar.grid(column=0, row=1, padx=20, pady=10)
         progress_bar.set(0)
         # get timetable data
-        self.lessonData = self.G4S.get_timetable(self.startDate,
-                                                 self.endDate)  # list of dictionaries (each one is a lesson)
+        self.lessonData = self.G4S.get_timetable(*self.G4S.format_date_range(
+            self.startDate, self.endDate))  # list of dictionaries (each one is a lesson)
+        self.snapshot.save_timetable(self.lessonData, self.startDate, self.endDate)
+
+        recurring_checkbox = ctk.CTkCheckBox(self, text="Add weekly lessons as recurring events")
+        recurring_checkbox.grid(column=0, row=2, padx=20, pady=10)
 
         button = ctk.CTkButton(self, text="Add to Calendar", command=add_lesson_to_calendar)
-        button.grid(column=0, row=2, padx=20, pady=15)
+        button.grid(column=0, row=3, padx=20, pady=15)
+
+        status_label = ctk.CTkLabel(self, text="")
+        status_label.grid(column=0, row=4, padx=20, pady=10)
 
     def add_homework_to_calendar(self):
         """
@@ -937,33 +1421,11 @@ class GUI(ctk.CTk, ABC):
 
         def add_task_to_calendar():
             """
-            Adds homework to Google calendar. I'm not sure that I need the update_progress method, I might just be
-            able to demote it, but I'm scared it will all shatter apart, getting the progress bar working was so
-            painful.
+            Adds homework to Google calendar in the background, see follow_sync_progress().
             """
-            number_of_tasks = len(self.homeworkData)
-            progress = 0
-
-            def update_progress():
-                """
-                !!!Generated by ChatGPT
-                Genuine witchcraft don't contact me asking how this works;
-                It uses nonlocal functions to update a progress bar. It's so complicated to prevent a bug
-                to do with customtkinter hogging all Pythons processing, which doesn't let the progress bar be
-                updated.
-                """
-                nonlocal progress
-                try:
-                    task = next(task_generator)
-                    self.GoogleSession.create_event_from_homework_singular(task)
-                    progress += 1
-                    progress_bar.set(progress / number_of_tasks)
-                    progress_bar.after(100, update_progress)
-                except StopIteration:
-                    pass
-
-            task_generator = (task for task in self.homeworkData)
-            update_progress()
+            if self.follow_sync_progress(homework_jobs(self.get_google_session(), self.homeworkData), progress_bar,
+                                         status_label, (button2,)):
+                button1.configure(state="disabled")
 
         self.clear_window()
 
@@ -975,15 +1437,80 @@ class GUI(ctk.CTk, ABC):
         progress_bar.set(0)
         # get timetable data
         self.homeworkData = self.G4S.get_homework()  # list of dictionaries (each one is a lesson)
+        self.snapshot.save_homework(self.homeworkData)
 
         button1 = ctk.CTkButton(self, text="Add to Calendar", command=add_task_to_calendar)
         button1.grid(column=0, row=2, padx=20, pady=10)
 
         button2 = ctk.CTkButton(self, text="Remove Duplicate Events",
-                                command=self.GoogleSession.remove_duplicate_events)
+                                command=lambda: self.remove_duplicate_events(status_label),
+                                state="disabled" if self.google_busy.locked() else "normal")
         button2.grid(column=0, row=3, padx=20, pady=15)
 
+        status_label = ctk.CTkLabel(self, text="")
+        status_label.grid(column=0, row=4, padx=20, pady=10)
+
+    def remove_duplicate_events(self, status_label: ctk.CTkLabel):
+        """
+        Runs google_calendar_session.remove_duplicate_events(), unless a sync is using the Google session in the
+        background.
+        """
+        if not self.google_busy.acquire(blocking=False):
+            status_label.configure(text="Wait for the sync to finish before removing duplicates.")
+            return
+        try:
+            self.get_google_session().remove_duplicate_events()
+        finally:
+            self.google_busy.release()
+
+    def export_to_ics(self):
+        """
+        Writes the timetable (for the dates chosen in date_selector) and homework to g4s_calendar.ics, which can be
+        imported into any calendar app without using up any Google API quota. Only days that changed since the last
+        export are regenerated. There is also a button to serve it as a subscription feed.
+        """
+        self.clear_window()
+        self.title("Export to .ics")
+
+        feed = ics_feed()
+        lessons = self.G4S.get_timetable(*self.G4S.format_date_range(self.startDate, self.endDate))
+        regenerated = feed.update(lessons, self.G4S.get_homework(), self.startDate, self.endDate)
+
+        title = ctk.CTkLabel(self, text="Exported to .ics", font=("Aharoni", 20, "bold"))
+        title.grid(column=0, row=0, padx=20, pady=10)
+        info = ctk.CTkLabel(self, text=f"Wrote {feed.path} ({regenerated} day(s) updated).")
+        info.grid(column=0, row=1, padx=20, pady=10)
+
+        def serve():
+            server = serve_feed(feed.path)
+            info.configure(text=f"Subscribe to http://localhost:{server.server_address[1]}/calendar.ics\n"
+                                f"(only while this window is open)")
+            button.configure(state="disabled")
+
+        button = ctk.CTkButton(self, text="Serve as Subscription Feed", command=serve)
+        button.grid(column=0, row=2, padx=20, pady=15)
+
 
 if __name__ == "__main__":
-    App = GUI()
-    App.mainloop()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cli", action="store_true", help="use the text main menu instead of the GUI")
+    parser.add_argument("--profile", nargs="?", const="g4s_profile", metavar="DIRECTORY",
+                        help="profile the whole run, and write the profile to DIRECTORY (g4s_profile by default) when "
+                             "it exits, see profiling.py")
+    args = parser.parse_args()
+
+    if args.profile:
+        profiler.start()
+    try:
+        if args.cli:
+            with profiler.span("main_menu"):
+                main_menu()
+        else:
+            with profiler.span("gui"):
+                App = GUI()
+                App.mainloop()
+    finally:
+        if args.profile:
+            profiler.stop()
+            profiler.print_summary()
+            print(f"{profiler.prefix} Written to {profiler.dump(args.profile)}/ (attach it to bug reports)")
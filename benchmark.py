@@ -0,0 +1,489 @@
+"""
+Reproducible benchmarks for Go4Schools_API_Access.py, run against local stand-ins of the Go4Schools login, timetable and
+homework endpoints and of the Google Calendar API, so nothing touches the real services.
+
+Example:
+    python benchmark.py --weeks 1 13 39 --students 1 10 --google-latency 0.02 --output bench_results.json
+    python benchmark.py --baseline bench_results.json  # exits with 1 if anything got slower than the baseline
+
+The stand-ins run in a separate process so that the peak memory (tracemalloc) only measures the sync itself. As
+tracemalloc slows Python down a lot, every scenario is run twice, once for timing and once for memory (unless
+--skip-memory is used).
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime, timedelta, date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+from calendars import CALENDAR_MODES, PRIMARY, colours, get_calendar_mode, set_calendar_mode
+from pipeline import run_pipeline
+from sync import sync_events, lesson_jobs, homework_jobs
+
+SUBJECTS = ("Maths", "Further Maths", "Physics", "Computer Sci", "Rg", "Chemistry")
+TEACHERS = ("Mr Smith", "Ms Jones", "Dr Brown", "Mrs Taylor", "Mr Wilson", "Ms Evans")
+PERIODS = (("08:45", "09:05"), ("09:05", "10:05"), ("10:05", "11:05"), ("11:25", "12:25"), ("13:15", "14:15"),
+           ("14:15", "15:15"))
+HOMEWORK_PER_WEEK = 4
+
+
+def fake_lessons(start: date, end: date) -> list[dict]:
+    """Builds a deterministic Go4Schools style timetable for every weekday between start and end (inclusive)."""
+    lessons = []
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            for period, (start_time, end_time) in enumerate(PERIODS):
+                index = (day.weekday() + period) % len(SUBJECTS)
+                lessons.append({
+                    "date": day.strftime("%Y-%m-%dT00:00:00"),
+                    "start_time": start_time,
+                    "end_time": end_time,
+                    "subject_name": SUBJECTS[index],
+                    "group_code": f"13{SUBJECTS[index][:2]}/{period}",
+                    "teacher_list": {str(index): TEACHERS[index]},
+                    "room_list": f"R{index}{period}",
+                })
+        day += timedelta(days=1)
+    return lessons
+
+
+def fake_homework(weeks: int) -> list[dict]:
+    """Builds deterministic homework, some already due (which get_homework() filters out) and the rest upcoming."""
+    today = date.today()
+    tasks = []
+    for i in range(-HOMEWORK_PER_WEEK, weeks * HOMEWORK_PER_WEEK):
+        due = today + timedelta(days=(i * 7) // HOMEWORK_PER_WEEK)
+        subject = SUBJECTS[i % len(SUBJECTS)]
+        tasks.append({
+            "title": f"{subject} homework {i}",
+            "details": f"Complete the {subject} worksheet. " * 5,
+            "subject_name": subject,
+            "due_date": due.strftime("%Y-%m-%dT00:00:00"),
+        })
+    return tasks
+
+
+def _parse_g4s_date(text: str) -> date:
+    """The app sends either "Mon, 01 Jan 2024 00:00:00 GMT" or str(datetime), so accept both."""
+    text = unquote(text).strip()
+    for date_format in ("%a, %d %b %Y %H:%M:%S GMT", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognised date '{text}'")
+
+
+def _parse_google_time(text: str) -> datetime:
+    """Parses a Google Calendar timeMin/timeMax or event time into a naive UTC datetime."""
+    text = text.replace("Z", "+00:00")
+    if len(text) == 10:
+        return datetime.fromisoformat(text)
+    parsed = datetime.fromisoformat(text)
+    if parsed.utcoffset() is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+class stand_in_handler(BaseHTTPRequestHandler):
+    """
+    Serves both the Go4Schools and the Google Calendar stand-ins. The behaviour (latency, quota errors and how much
+    homework there is) is read from the server's "settings" dictionary.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass  # stay quiet, the benchmark prints its own results
+
+    def _send(self, status: int, body, content_type: str = "application/json", headers: dict = None):
+        if not isinstance(body, (str, bytes)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _throttled(self, service: str) -> bool:
+        """Sleeps for the configured latency, then decides if this request gets a quota error."""
+        settings = self.server.settings
+        time.sleep(settings[f"{service}_latency"])
+        every = settings[f"{service}_quota_every"]
+        if not every:
+            return False
+        with self.server.lock:
+            self.server.counters[service] += 1
+            return self.server.counters[service] % every == 0
+
+    def _quota_error(self, service: str):
+        if service == "google":
+            self._send(403, {"error": {"code": 403, "message": "Rate Limit Exceeded",
+                                       "errors": [{"reason": "rateLimitExceeded"}]}})
+        else:
+            self._send(429, {"message": "Too many requests"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith("/calendar/v3/"):
+            return self._google("GET", url)
+        if self._throttled("g4s"):
+            return self._quota_error("g4s")
+
+        if url.path == "/sso/account/login":
+            return self._send(200, '<form><input name="__RequestVerificationToken" type="hidden" '
+                                   'value="fake-csrf-token" /></form>', "text/html")
+        if url.path == "/student/home":
+            return self._send(200, '<script>var s_schoolID = 1234;\nvar accessToken = "fake-access-token";</script>'
+                                   '<a href="/student/timetable?sid=5678">Timetable</a>', "text/html")
+        if "/timetable/" in url.path:
+            parts = unquote(url.path).split("/")
+            start = _parse_g4s_date(parts[parts.index("from-date") + 1])
+            end = _parse_g4s_date(parts[parts.index("to-date") + 1])
+            return self._send(200, {"student_timetable": fake_lessons(start, end)})
+        if "/homework/" in url.path:
+            return self._send(200, {"student_homework": {"homework": fake_homework(self.server.settings["weeks"])}})
+        return self._send(404, "Not found", "text/html")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/__reset":
+            with self.server.lock:
+                self.server.calendars.clear()
+                self.server.calendar_list.clear()
+            return self._send(200, {})
+        if url.path.startswith("/calendar/v3/"):
+            return self._google("POST", url)
+        self._read_body()
+        if self._throttled("g4s"):
+            return self._quota_error("g4s")
+        if url.path == "/sso/account/login":
+            return self._send(302, "", "text/html", {"Location": "/student/home"})
+        return self._send(404, "Not found", "text/html")
+
+    def do_DELETE(self):
+        return self._google("DELETE", urlparse(self.path))
+
+    def do_PATCH(self):
+        return self._google("PATCH", urlparse(self.path))
+
+    def _google(self, method: str, url):
+        """
+        Minimal stand-in for calendar/v3 events list, insert, patch and delete, calendar insert and calendarList list.
+        """
+        body = self._read_body()
+        if self._throttled("google"):
+            return self._quota_error("google")
+
+        if url.path == "/calendar/v3/users/me/calendarList":
+            with self.server.lock:
+                return self._send(200, {"kind": "calendar#calendarList",
+                                        "items": list(self.server.calendar_list.values())})
+        if url.path == "/calendar/v3/calendars" and method == "POST":
+            calendar = json.loads(body)
+            with self.server.lock:
+                calendar["id"] = f"calendar{len(self.server.calendar_list) + 1}@group.calendar.google.com"
+                self.server.calendar_list[calendar["id"]] = calendar
+            return self._send(200, calendar)
+
+        parts = url.path.split("/")  # ['', 'calendar', 'v3', 'calendars', id, 'events', (eventId)]
+        if len(parts) < 6 or parts[5] != "events":
+            return self._send(404, {"error": {"code": 404, "message": "Not Found"}})
+        calendar_id = unquote(parts[4])
+        with self.server.lock:
+            events = self.server.calendars.setdefault(calendar_id, {})
+
+            if method == "POST":
+                event = json.loads(body)
+                event["id"] = f"event{len(events) + 1}"
+                events[event["id"]] = event
+                return self._send(200, event)
+
+            if method == "DELETE":
+                events.pop(unquote(parts[6]), None)
+                return self._send(204, b"")
+
+            if method == "PATCH":
+                event = events.get(unquote(parts[6]))
+                if event is None:
+                    return self._send(404, {"error": {"code": 404, "message": "Not Found"}})
+                event.update(json.loads(body))
+                return self._send(200, event)
+
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            if "privateExtendedProperty" in query:
+                key, _, value = query["privateExtendedProperty"].partition("=")
+                matching = [event for event in events.values()
+                            if event.get("extendedProperties", {}).get("private", {}).get(key) == value]
+                return self._send(200, {"kind": "calendar#events", "items": matching})
+            time_min = _parse_google_time(query["timeMin"]) if "timeMin" in query else None
+            time_max = _parse_google_time(query["timeMax"]) if "timeMax" in query else None
+            items = []
+            for event in events.values():
+                event_start = _parse_google_time(event["start"].get("dateTime") or event["start"]["date"])
+                event_end = _parse_google_time(event["end"].get("dateTime") or event["end"]["date"])
+                if (time_max is None or event_start < time_max) and (time_min is None or event_end > time_min):
+                    items.append(event)
+            items.sort(key=lambda item: item["start"].get("dateTime") or item["start"]["date"])
+            items = items[:int(query.get("maxResults", 2500))]
+        return self._send(200, {"kind": "calendar#events", "items": items})
+
+
+def run_stand_ins(port_queue, settings: dict) -> None:
+    """Runs the stand-in server until the process is terminated. The chosen port is put on port_queue."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stand_in_handler)
+    server.daemon_threads = True
+    server.settings = settings
+    server.lock = threading.Lock()
+    server.counters = {"g4s": 0, "google": 0}
+    server.calendars = {}
+    server.calendar_list = {}
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def build_fake_calendar_service(base_url: str):
+    """Builds a googleapiclient calendar service which talks to the stand-in instead of googleapis.com."""
+    import httplib2
+    from googleapiclient.discovery import build
+    return build("calendar", "v3", http=httplib2.Http(), static_discovery=True,
+                 client_options={"api_endpoint": base_url + "/calendar/v3/"})
+
+
+def sync_student(app, base_url: str, weeks: int, recurring: bool = False) -> dict:
+    """
+    Logs a fake student in and syncs their timetable and homework to the stand-in calendar. With recurring=True
+    weekly lessons are written as recurring events.
+    """
+    import requests
+    requests.post(base_url + "/__reset")
+
+    g4s = app.go4schools_session("student", "password")
+    start = date.today() - timedelta(days=date.today().weekday())
+    end = start + timedelta(days=weeks * 7 - 1)
+    lessons = g4s.get_timetable(start.strftime("%a, %d %b %Y 00:00:00 GMT"), end.strftime("%a, %d %b %Y 23:59:59 GMT"))
+    homework = g4s.get_homework()
+
+    google_session = app.google_calendar_session(service=build_fake_calendar_service(base_url))
+    jobs = lesson_jobs(google_session, lessons, recurring) + homework_jobs(google_session, homework)
+    finished = list(sync_events(jobs))[-1]
+    return {"lessons": len(lessons), "homework": len(homework), "failed_writes": finished.counts["failed"],
+            "throttled_writes": finished.counts["throttled"]}
+
+
+def pipeline_students(app, base_url: str, weeks: int, students: int, time_budget: float = None) -> dict:
+    """
+    Syncs the given number of (fake) students through pipeline.run_pipeline(), logging each one in only when the
+    pipeline reaches them. The stand-in calendar is only reset once, so every student after the first finds their
+    events already exist, like a nightly re-sync. With a time_budget (seconds), the run gets a deadline like a
+    scheduled sync would.
+    """
+    import requests
+    from transport import deadline
+    requests.post(base_url + "/__reset")
+
+    def login(request_deadline):
+        return (app.go4schools_session("student", "password", request_deadline),
+                app.google_calendar_session(service=build_fake_calendar_service(base_url)))
+
+    start = date.today() - timedelta(days=date.today().weekday())
+    request_deadline = deadline(time_budget) if time_budget else None
+    finished = deque(run_pipeline([login] * students, start, weeks, request_deadline=request_deadline),
+                     maxlen=1)[0]
+    return {"events": finished.done, "failed_writes": finished.counts["failed"],
+            "throttled_writes": finished.counts["throttled"]}
+
+
+def measure_gui_render(app) -> float:
+    """Times building the timetable and homework tabs for one week, returns None if there is no display."""
+    try:
+        root = app.ctk.CTk()
+    except Exception:
+        return None
+    root.withdraw()
+    start_of_week = date.today() - timedelta(days=date.today().weekday())
+    lessons = fake_lessons(start_of_week, start_of_week + timedelta(days=6))
+    homework = fake_homework(4)
+    start = time.perf_counter()
+    app.timetable_tab(root=root, data=lessons).grid(row=0, column=0)
+    app.homework_tab(root=root, homework_data=homework).grid(row=0, column=1)
+    root.update_idletasks()
+    elapsed = time.perf_counter() - start
+    root.destroy()
+    return elapsed
+
+
+def sync_students(app, base_url: str, weeks: int, students: int, recurring: bool = False,
+                  pipeline: bool = False, time_budget: float = None) -> dict:
+    """Syncs the given number of students one after another, with all the app's printing hidden."""
+    if pipeline:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return pipeline_students(app, base_url, weeks, students, time_budget)
+    totals = {"lessons": 0, "homework": 0, "failed_writes": 0, "throttled_writes": 0}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(students):
+            for key, value in sync_student(app, base_url, weeks, recurring).items():
+                totals[key] += value
+    return totals
+
+
+def run_scenario(app, base_url: str, weeks: int, students: int, measure_memory: bool = True,
+                 recurring: bool = False, pipeline: bool = False, time_budget: float = None) -> dict:
+    """Runs a single weeks x students scenario and returns its measurements."""
+    from instrumentation import metrics
+    metrics.reset()
+
+    start = time.perf_counter()
+    totals = sync_students(app, base_url, weeks, students, recurring, pipeline, time_budget)
+    elapsed = time.perf_counter() - start
+    summary = metrics.summary()
+
+    peak = None
+    if measure_memory:
+        tracemalloc.start()
+        sync_students(app, base_url, weeks, students, recurring, pipeline, time_budget)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        "name": f"weeks={weeks},students={students}" + (",recurring" if recurring else "") + (
+            ",pipeline" if pipeline else "") + ("" if get_calendar_mode() == PRIMARY else "," + get_calendar_mode()) + (
+            f",budget={time_budget}s" if time_budget else ""),
+        "weeks": weeks,
+        "students": students,
+        "sync_seconds": round(elapsed, 4),
+        "peak_memory_bytes": peak,
+        "api_calls": summary["totals"]["calls"],
+        "api_calls_by_endpoint": {name: stats["calls"] for name, stats in summary["endpoints"].items()},
+        "quota_errors": summary["totals"]["quota_errors"],
+        **totals,
+    }
+
+
+def compare_to_baseline(results: dict, baseline_file: str, tolerance: float) -> list[str]:
+    """Returns a list of regressions, where a scenario got slower, used more memory or made more API calls."""
+    with open(baseline_file) as f:
+        baseline = {scenario["name"]: scenario for scenario in json.load(f)["scenarios"]}
+
+    regressions = []
+    for scenario in results["scenarios"]:
+        old = baseline.get(scenario["name"])
+        if not old:
+            continue
+        for key in ("sync_seconds", "peak_memory_bytes", "api_calls"):
+            if old.get(key) and scenario.get(key) and scenario[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{scenario['name']}: {key} went from {old[key]} to {scenario[key]}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weeks", type=int, nargs="+", default=[1, 4, 13, 39],
+                        help="timetable lengths to sync, 39 weeks is a full academic year")
+    parser.add_argument("--students", type=int, nargs="+", default=[1, 10],
+                        help="number of students synced one after another, up to 500")
+    parser.add_argument("--g4s-latency", type=float, default=0.0, help="seconds added to every Go4Schools request")
+    parser.add_argument("--google-latency", type=float, default=0.0, help="seconds added to every Google request")
+    parser.add_argument("--g4s-quota-every", type=int, default=0, help="every Nth Go4Schools request gets a 429")
+    parser.add_argument("--google-quota-every", type=int, default=0,
+                        help="every Nth Google request gets a 403 rateLimitExceeded")
+    parser.add_argument("--recurring", action="store_true", help="write weekly lessons as recurring events")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="sync through the bounded fetch/normalise/diff/write pipeline (ignores --recurring)")
+    parser.add_argument("--time-budget", type=float, metavar="SECONDS",
+                        help="give each --pipeline run a deadline, students not started by then fail")
+    parser.add_argument("--calendar-mode", choices=CALENDAR_MODES, default=PRIMARY,
+                        help="which calendar(s) events are written to, see calendars.py")
+    parser.add_argument("--skip-memory", action="store_true", help="don't measure peak memory (halves the runtime)")
+    parser.add_argument("--gui", action="store_true", help="also time rendering the timetable and homework tabs")
+    parser.add_argument("--profile", metavar="DIRECTORY",
+                        help="profile the syncs and write the profile to DIRECTORY, see profiling.py")
+    parser.add_argument("--output", help="file to write the JSON results to (printed otherwise)")
+    parser.add_argument("--baseline", help="previous JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="how much worse than the baseline counts as a regression (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    import Go4Schools_API_Access as app
+    set_calendar_mode(args.calendar_mode)
+    # keep the fake subjects out of the real colour map
+    colours.path = os.path.join(tempfile.mkdtemp(), "g4s_colours.json")
+    from profiling import profiler
+
+    port_queue = multiprocessing.Queue()
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "settings": vars(args),
+        "scenarios": [],
+    }
+    if args.profile:
+        profiler.start()
+    for weeks in args.weeks:
+        settings = {"weeks": weeks, "g4s_latency": args.g4s_latency, "google_latency": args.google_latency,
+                    "g4s_quota_every": args.g4s_quota_every, "google_quota_every": args.google_quota_every}
+        server = multiprocessing.Process(target=run_stand_ins, args=(port_queue, settings), daemon=True)
+        server.start()
+        base_url = f"http://127.0.0.1:{port_queue.get(timeout=10)}"
+        app.go4schools_session.web_url = base_url
+        app.go4schools_session.api_url = base_url
+        try:
+            for students in args.students:
+                scenario = run_scenario(app, base_url, weeks, students, not args.skip_memory, args.recurring,
+                                        args.pipeline, args.time_budget)
+                results["scenarios"].append(scenario)
+                print(f"[Benchmark] {scenario['name']}: {scenario['sync_seconds']}s, "
+                      f"{scenario['api_calls']} API calls, peak memory {scenario['peak_memory_bytes']} bytes",
+                      file=sys.stderr)
+        finally:
+            server.terminate()
+            server.join()
+
+    if args.gui:
+        results["gui_render_seconds"] = measure_gui_render(app)
+
+    if args.profile:
+        profiler.stop()
+        results["profile"] = profiler.dump(args.profile)
+        results["profile_spans"] = profiler.span_summary()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"[Benchmark] Regression: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
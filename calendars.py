@@ -0,0 +1,87 @@
+"""
+Which Google calendar each event goes in, and what colour it is. Events can go in the user's primary calendar (the
+original behaviour), in one calendar managed by this app, or in a calendar per subject. The app's own calendars are
+created on demand, and duplicate scans only look at them rather than every personal event.
+"""
+
+import json
+import os
+import threading
+
+from useful_functions import atomic_write
+
+# calendar_mode options (config.txt)
+PRIMARY = "primary"
+MANAGED = "managed"
+PER_SUBJECT = "per_subject"
+CALENDAR_MODES = (PRIMARY, MANAGED, PER_SUBJECT)
+
+MANAGED_CALENDAR_NAME = "Go4Schools"
+# every calendar the app creates has this description, which is how they're found again
+MANAGED_DESCRIPTION = "Created and managed by the G4S Google Calendar App."
+# homework without a subject goes in this calendar in per_subject mode
+HOMEWORK_SUBJECT = "Homework"
+
+# Google Calendar has 11 event colours, "1" to "11"
+EVENT_COLOURS = tuple(str(colour) for colour in range(1, 12))
+
+_calendar_mode = PRIMARY
+
+
+def set_calendar_mode(calendar_mode: str) -> None:
+    """Sets where new google_calendar_sessions put events, raises ValueError if it isn't one of CALENDAR_MODES."""
+    global _calendar_mode
+    if calendar_mode not in CALENDAR_MODES:
+        raise ValueError(f"calendar_mode must be one of {', '.join(CALENDAR_MODES)}, not {calendar_mode!r}.")
+    _calendar_mode = calendar_mode
+
+
+def get_calendar_mode() -> str:
+    return _calendar_mode
+
+
+def calendar_name(calendar_mode: str, subject: str) -> str:
+    """The name of the calendar an event for "subject" goes in (the primary calendar isn't named)."""
+    if calendar_mode == PER_SUBJECT:
+        return f"{MANAGED_CALENDAR_NAME} - {subject}"
+    return MANAGED_CALENDAR_NAME
+
+
+class subject_colours(object):
+    """
+    A subject -> Google event colour map, saved to a JSON file so a subject keeps its colour between runs. Each new
+    subject gets the least used colour, so subjects only share a colour once all 11 are taken (rather than whenever
+    they start with letters 11 apart).
+    """
+
+    def __init__(self, path: str = "g4s_colours.json"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._colours = None
+
+    def _load(self) -> dict:
+        if self._colours is None:
+            self._colours = {}
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    self._colours = json.load(f)
+        return self._colours
+
+    def _save(self) -> None:
+        with atomic_write(self.path) as f:
+            json.dump(self._colours, f, indent=2, sort_keys=True)
+
+    def colour(self, subject) -> str:
+        """The colorId for a subject, assigning (and saving) one if it's new."""
+        subject = str(subject)
+        with self._lock:
+            colours = self._load()
+            if subject not in colours:
+                used = list(colours.values())
+                colours[subject] = min(EVENT_COLOURS, key=lambda colour: (used.count(colour), int(colour)))
+                self._save()
+            return colours[subject]
+
+
+# shared, so every session agrees on the colours
+colours = subject_colours()
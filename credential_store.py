@@ -0,0 +1,144 @@
+"""
+Process safe storage of the Google OAuth credentials (token.pickle), with background refreshing so a sync never has
+to wait for an OAuth round trip, and several sync workers can share (and refresh) the same token without corrupting it.
+"""
+
+import os
+import pickle
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+
+from useful_functions import atomic_write
+
+try:
+    import msvcrt
+except ImportError:  # not Windows
+    msvcrt = None
+    import fcntl
+
+# refresh the access token this long before it expires
+REFRESH_MARGIN = timedelta(minutes=5)
+
+
+@contextmanager
+def file_lock(lock_path: str):
+    """Holds an exclusive lock on lock_path (across processes) for the duration of the with block."""
+    with open(lock_path, "a+b") as lock_file:
+        if msvcrt:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if msvcrt:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _needs_refresh(creds) -> bool:
+    if not creds.valid:
+        return True
+    # google-auth stores expiry as a naive UTC datetime
+    return creds.expiry is not None and creds.expiry - REFRESH_MARGIN <= datetime.utcnow()
+
+
+class credential_store(object):
+    """
+    Reads and writes pickled Google credentials while holding a lock file, and writes them atomically, so
+    concurrent processes never see a half written token. Only one process refreshes an expiring token, the others
+    wait on the lock and then pick up the refreshed one from the file.
+    """
+
+    def __init__(self, path: str = "token.pickle"):
+        self.prefix = "[Credentials]"
+        self.path = path
+        self.lock_path = path + ".lock"
+        self._refresh_thread = None
+        self._stop = threading.Event()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as token:
+            return pickle.load(token)
+
+    def _save(self, creds) -> None:
+        with atomic_write(self.path, "wb") as token:
+            pickle.dump(creds, token)
+
+    def save(self, creds) -> None:
+        """Saves credentials (e.g. from a new OAuth flow) to the store."""
+        with file_lock(self.lock_path):
+            self._save(creds)
+
+    def get_credentials(self):
+        """
+        Returns the stored credentials, refreshed first if they have expired (or are about to). Returns None if there
+        are no stored credentials, or they can't be refreshed, in which case the user needs to log in again.
+        """
+        with file_lock(self.lock_path):
+            creds = self._load()
+            if creds and _needs_refresh(creds):
+                if not creds.refresh_token:
+                    return None
+                try:
+                    creds.refresh(Request())
+                except RefreshError as error:
+                    # the refresh token was revoked or has expired
+                    print(f"{self.prefix} Stored credentials can't be refreshed, log in again: {error}")
+                    return None
+                self._save(creds)
+        return creds
+
+    def refresh_shared(self, creds) -> None:
+        """
+        Brings an in-use credentials object up to date. If another process already refreshed the token, its token is
+        copied over, otherwise this process refreshes it and saves it for the others. The object is updated in place
+        so any service built with it carries on using it.
+        """
+        with file_lock(self.lock_path):
+            stored = self._load()
+            if stored and not _needs_refresh(stored) and stored.expiry and (
+                    creds.expiry is None or stored.expiry > creds.expiry):
+                creds.token = stored.token
+                creds.expiry = stored.expiry
+                return
+            if _needs_refresh(creds) and creds.refresh_token:
+                creds.refresh(Request())
+                self._save(creds)
+
+    def start_background_refresh(self, creds) -> None:
+        """
+        Starts a daemon thread which refreshes creds REFRESH_MARGIN before they expire, for as long as the program
+        runs, so the token is always fresh when a request needs it.
+        """
+        if self._refresh_thread is not None:
+            return
+
+        def refresh_loop():
+            while not self._stop.is_set():
+                if creds.expiry is None:
+                    return
+                wait = (creds.expiry - REFRESH_MARGIN - datetime.utcnow()).total_seconds()
+                # get_credentials() already made sure they start fresh, so never spin faster than every 30s
+                if self._stop.wait(max(wait, 30)):
+                    return
+                try:
+                    self.refresh_shared(creds)
+                except Exception as error:
+                    print(f"{self.prefix} Background refresh failed, retrying in a minute: {error}")
+                    self._stop.wait(60)
+
+        self._refresh_thread = threading.Thread(target=refresh_loop, daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self) -> None:
+        self._stop.set()
@@ -0,0 +1,30 @@
+"""An index of homework tasks by due date, so "upcoming only" queries are range lookups instead of full rescans."""
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+
+class homework_index(object):
+    """
+    Homework tasks (from the Go4Schools homework endpoint) sorted by due date. Every due_date is parsed once when the
+    index is built, after that between() and upcoming() are binary searches.
+    """
+
+    def __init__(self, tasks: list[dict]):
+        entries = sorted(((datetime.fromisoformat(task["due_date"]), i, task) for i, task in enumerate(tasks)),
+                         key=lambda entry: entry[:2])
+        self.due_dates = [entry[0] for entry in entries]
+        self.tasks = [entry[2] for entry in entries]
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def between(self, start: datetime = None, end: datetime = None) -> list[dict]:
+        """Tasks due from start (inclusive) up to end (inclusive), in due date order. None means unbounded."""
+        low = bisect_left(self.due_dates, start) if start else 0
+        high = bisect_right(self.due_dates, end) if end else len(self.tasks)
+        return self.tasks[low:high]
+
+    def upcoming(self, since: datetime) -> list[dict]:
+        """Tasks due on or after "since", in due date order."""
+        return self.between(since)
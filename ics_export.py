@@ -0,0 +1,246 @@
+"""
+Exports the timetable and homework to an iCalendar (.ics) file, which calendar apps can import or subscribe to, as an
+alternative to creating every event through the Google Calendar API.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from time_zones import get_time_zone, utc_stamp
+from useful_functions import atomic_write, days_between
+
+PRODUCT_ID = "-//G4S Google Calendar App//Go4Schools Export//EN"
+TIME_ZONE = "Europe/London"
+
+# Go4Schools times are UK wall clock times, so the events reference this zone
+VTIMEZONE = (
+    "BEGIN:VTIMEZONE",
+    "TZID:Europe/London",
+    "BEGIN:DAYLIGHT",
+    "TZOFFSETFROM:+0000",
+    "TZOFFSETTO:+0100",
+    "TZNAME:BST",
+    "DTSTART:19810329T010000",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "END:DAYLIGHT",
+    "BEGIN:STANDARD",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0000",
+    "TZNAME:GMT",
+    "DTSTART:19961027T020000",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+)
+
+
+def escape_text(text) -> str:
+    """Escapes a TEXT value as RFC 5545 requires."""
+    text = str(text or "").replace("\r\n", "\n").replace("\\r\\", "\n")
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def fold_line(line: str) -> str:
+    """Folds a content line into chunks of at most 75 octets (without splitting a UTF-8 character), joined by CRLF."""
+    if len(line.encode("utf-8")) <= 75:
+        return line + "\r\n"
+    folded = []
+    current = ""
+    current_length = 0
+    for character in line:
+        character_length = len(character.encode("utf-8"))
+        # continuation lines start with a space, which counts towards their 75 octets
+        limit = 75 if not folded else 74
+        if current_length + character_length > limit:
+            folded.append(current)
+            current = ""
+            current_length = 0
+        current += character
+        current_length += character_length
+    folded.append(current)
+    return "\r\n ".join(folded) + "\r\n"
+
+
+def _uid(*parts) -> str:
+    return hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest() + "@g4s-calendar"
+
+
+def lesson_to_vevent(lesson: dict, timestamp: str) -> str:
+    """Returns the VEVENT for a lesson from go4schools_session.get_timetable(), or "" for free periods."""
+    subject_name = lesson["subject_name"]
+    if subject_name in ["None", None]:
+        return ""
+    day = lesson["date"][:10].replace("-", "")
+    start = day + "T" + lesson["start_time"].replace(":", "") + "00"
+    end = day + "T" + lesson["end_time"].replace(":", "") + "00"
+    teachers = ", ".join((lesson.get("teacher_list") or {}).values())
+    description = f"{lesson.get('group_code') or ''}\n{teachers}\n{lesson.get('room_list') or ''}"
+    if get_time_zone() == TIME_ZONE:
+        start_line, end_line = f"DTSTART;TZID={TIME_ZONE}:{start}", f"DTEND;TZID={TIME_ZONE}:{end}"
+    else:  # only Europe/London has a VTIMEZONE here, so lessons in any other configured zone are written in UTC
+        start_line = "DTSTART:" + utc_stamp(lesson["date"], lesson["start_time"])
+        end_line = "DTEND:" + utc_stamp(lesson["date"], lesson["end_time"])
+    lines = (
+        "BEGIN:VEVENT",
+        f"UID:{_uid('lesson', subject_name, lesson.get('group_code'), start)}",
+        f"DTSTAMP:{timestamp}",
+        start_line,
+        end_line,
+        f"SUMMARY:{escape_text(subject_name)}",
+        f"LOCATION:{escape_text(lesson.get('room_list'))}",
+        f"DESCRIPTION:{escape_text(description)}",
+        "END:VEVENT",
+    )
+    return "".join(fold_line(line) for line in lines)
+
+
+def homework_to_vevent(task: dict, timestamp: str) -> str:
+    """Returns the all day VEVENT for a homework task from go4schools_session.get_homework()."""
+    due_date = datetime.strptime(task["due_date"], '%Y-%m-%dT%H:%M:%S')
+    lines = (
+        "BEGIN:VEVENT",
+        f"UID:{_uid('homework', task['title'], task.get('subject_name'), task['due_date'])}",
+        f"DTSTAMP:{timestamp}",
+        f"DTSTART;VALUE=DATE:{due_date.strftime('%Y%m%d')}",
+        f"DTEND;VALUE=DATE:{(due_date + timedelta(days=1)).strftime('%Y%m%d')}",
+        f"SUMMARY:{escape_text(task['title'])}",
+        f"DESCRIPTION:{escape_text(task.get('details'))}",
+        "TRANSP:TRANSPARENT",
+        "END:VEVENT",
+    )
+    return "".join(fold_line(line) for line in lines)
+
+
+def _utc_timestamp() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _write_calendar(path: str, fragments) -> None:
+    """Streams the calendar header, every fragment (an iterable of VEVENT strings) and the footer to path."""
+    # replaced in one go so anyone subscribed never downloads a half written file
+    with atomic_write(path, encoding="utf-8", newline="") as f:
+        for line in ("BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{PRODUCT_ID}", "CALSCALE:GREGORIAN",
+                     "METHOD:PUBLISH", "X-WR-CALNAME:Go4Schools", f"X-WR-TIMEZONE:{TIME_ZONE}") + VTIMEZONE:
+            f.write(fold_line(line))
+        for fragment in fragments:
+            f.write(fragment)
+        f.write(fold_line("END:VCALENDAR"))
+
+
+def write_ics(path: str, lessons: list[dict] = (), homework: list[dict] = ()) -> None:
+    """Writes lessons and homework to a .ics file in a single streaming pass."""
+    timestamp = _utc_timestamp()
+    events = (lesson_to_vevent(lesson, timestamp) for lesson in lessons)
+    tasks = (homework_to_vevent(task, timestamp) for task in homework)
+    _write_calendar(path, (event for generator in (events, tasks) for event in generator))
+
+
+class ics_feed(object):
+    """
+    An .ics file which is regenerated a day at a time. Each day's lessons and homework are cached in cache_dir along
+    with a hash of the Go4Schools data they were made from, so update() only rebuilds the days whose data changed and
+    then stitches the cached days back together. Days outside the fetched range are kept, so exporting one week (or
+    part of one) at a time builds up the whole year, while days inside it are replaced, including ones that no longer
+    have any lessons.
+    """
+
+    def __init__(self, path: str = "g4s_calendar.ics", cache_dir: str = ".ics_cache"):
+        self.prefix = "[ICS]"
+        self.path = path
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "index.json")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def _fragment_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".ics.part")
+
+    def _remove(self, key: str) -> None:
+        self.index.pop(key, None)
+        if os.path.exists(self._fragment_path(key)):
+            os.remove(self._fragment_path(key))
+
+    def update(self, lessons: list[dict] = (), homework: list[dict] = None, start: date = None,
+               end: date = None) -> int:
+        """
+        Regenerates the days that changed, rewrites the feed, and returns the number of days regenerated.
+
+        start and end (dates or datetimes) are the range the lessons were fetched for, every cached day in it without
+        lessons is dropped. Without them, only the days the lessons are on are replaced. homework is every task
+        Go4Schools has, so cached tasks that aren't in it any more are dropped, None keeps the cached homework.
+        """
+        days = {}
+        for lesson in lessons:
+            days.setdefault("lessons-" + lesson["date"][:10], []).append(lesson)
+        stale = set()
+        if start is not None and end is not None:
+            stale.update("lessons-" + day for day in days_between(start, end))
+        if homework is not None:
+            stale.update(key for key in self.index if key.startswith("homework-"))
+            for task in homework:
+                days.setdefault("homework-" + task["due_date"][:10], []).append(task)
+
+        for key in stale - days.keys():
+            self._remove(key)
+
+        timestamp = _utc_timestamp()
+        regenerated = 0
+        for key, items in days.items():
+            data_hash = hashlib.sha1(json.dumps(items, sort_keys=True).encode()).hexdigest()
+            if self.index.get(key) == data_hash and os.path.exists(self._fragment_path(key)):
+                continue
+            to_vevent = lesson_to_vevent if key.startswith("lessons-") else homework_to_vevent
+            with atomic_write(self._fragment_path(key), encoding="utf-8", newline="") as f:
+                for item in items:
+                    f.write(to_vevent(item, timestamp))
+            self.index[key] = data_hash
+            regenerated += 1
+
+        with atomic_write(self.index_path) as f:
+            json.dump(self.index, f)
+
+        _write_calendar(self.path, self._read_fragments())
+        print(f"{self.prefix} Regenerated {regenerated} of {len(days)} day(s), wrote {self.path}.")
+        return regenerated
+
+    def _read_fragments(self):
+        for key in sorted(self.index):
+            if os.path.exists(self._fragment_path(key)):
+                with open(self._fragment_path(key), encoding="utf-8", newline="") as f:
+                    yield f.read()
+
+
+def serve_feed(path: str = "g4s_calendar.ics", port: int = 8000, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serves the .ics file at http://host:port/calendar.ics in a background thread, so calendar apps can subscribe to
+    it. The file is re-read on every request, so updating it with ics_feed.update() updates the subscription too.
+    Call .shutdown() on the returned server to stop it.
+    """
+
+    class feed_handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/calendar.ics" or not os.path.exists(path):
+                self.send_error(404)
+                return
+            with open(path, "rb") as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/calendar; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), feed_handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[ICS] Serving {path} at http://{host}:{server.server_address[1]}/calendar.ics")
+    return server
@@ -0,0 +1,250 @@
+"""Metrics for every outbound API call made to Go4Schools and Google Calendar, so we can see where sync time goes."""
+
+import json
+import threading
+from time import perf_counter
+
+from profiling import profiler
+
+# upper bounds (in seconds) of the latency histogram buckets, the last bucket is +Inf
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# statuses/reasons Google and Go4Schools use when you are sending too many requests
+QUOTA_STATUSES = (429,)
+QUOTA_REASONS = ("rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded", "dailyLimitExceeded")
+
+
+def is_quota_error(error: Exception) -> bool:
+    """True if a googleapiclient HttpError (or anything with .resp.status and .content) is a quota/rate limit error."""
+    status = getattr(getattr(error, "resp", None), "status", None)
+    content = getattr(error, "content", b"") or b""
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", "replace")
+    return status in QUOTA_STATUSES or (status == 403 and any(reason in content for reason in QUOTA_REASONS))
+
+
+class endpoint_stats(object):
+    """
+    Counters and a latency histogram for a single endpoint, e.g. "go4schools.timetable" or "calendar.events.insert".
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.quota_errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.statuses = {}
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, latency: float, status=None, bytes_sent: int = 0, bytes_received: int = 0,
+                quota_error: bool = False, error: bool = False) -> None:
+        """Adds a single call to the stats."""
+        self.calls += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+        if status is not None:
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if quota_error:
+            self.quota_errors += 1
+        if error:
+            self.errors += 1
+
+        for i, upper_bound in enumerate(LATENCY_BUCKETS):
+            if latency <= upper_bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def as_dict(self) -> dict:
+        """Returns the stats as a JSON friendly dictionary."""
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "quota_errors": self.quota_errors,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "total_latency_s": round(self.total_latency, 6),
+            "mean_latency_s": round(self.total_latency / self.calls, 6) if self.calls else 0.0,
+            "max_latency_s": round(self.max_latency, 6),
+            "statuses": dict(self.statuses),
+        }
+
+
+class api_metrics(object):
+    """
+    Records latency, status, bytes transferred, retries and quota errors of every outbound API call, per endpoint.
+    Use timed_request() to wrap a requests call and timed_execute() to wrap a googleapiclient request. The results
+    can be read with summary()/summary_json() or prometheus_text().
+
+    Everything is kept twice: since the program started (or reset()), and since the current sync started
+    (begin_sync()), so the summary printed after a sync only covers that sync rather than logins and earlier syncs.
+    """
+
+    def __init__(self):
+        self.prefix = "[Metrics]"
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.sync_counts = {}
+        self.current_endpoints = {}
+        self.current_sync_counts = {}
+
+    def reset(self) -> None:
+        """Forgets everything recorded so far."""
+        with self._lock:
+            self.endpoints = {}
+            self.sync_counts = {}
+            self.current_endpoints = {}
+            self.current_sync_counts = {}
+
+    def begin_sync(self) -> None:
+        """Starts counting the calls of a new sync, call this at the start of every sync."""
+        with self._lock:
+            self.current_endpoints = {}
+            self.current_sync_counts = {}
+
+    def record_sync(self, counts: dict) -> None:
+        """Adds the final created/skipped/failed/... counts of a sync (from sync.sync_events())."""
+        with self._lock:
+            for sync_counts in (self.sync_counts, self.current_sync_counts):
+                for kind, count in counts.items():
+                    sync_counts[kind] = sync_counts.get(kind, 0) + count
+
+    def _stats(self, endpoint: str):
+        """The endpoint's stats since the program started and since the current sync started."""
+        for endpoints in (self.endpoints, self.current_endpoints):
+            if endpoint not in endpoints:
+                endpoints[endpoint] = endpoint_stats(endpoint)
+            yield endpoints[endpoint]
+
+    def record(self, endpoint: str, latency: float, status=None, bytes_sent: int = 0, bytes_received: int = 0,
+               quota_error: bool = False, error: bool = False) -> None:
+        """Records a single call to an endpoint."""
+        with self._lock:
+            for stats in self._stats(endpoint):
+                stats.observe(latency, status, bytes_sent, bytes_received, quota_error, error)
+
+    def record_retry(self, endpoint: str) -> None:
+        """Records that a call to an endpoint was retried."""
+        with self._lock:
+            for stats in self._stats(endpoint):
+                stats.retries += 1
+
+    def timed_request(self, endpoint: str, send, *args, **kwargs):
+        """
+        Calls send(*args, **kwargs) (e.g. requests.get or session.post) and records how long it took, the status
+        code and the size of the request and response.
+        """
+        body = kwargs.get("data") or b""
+        bytes_sent = len(body) if isinstance(body, (str, bytes)) else len(str(body))
+        start = perf_counter()
+        try:
+            with profiler.span("http " + endpoint):
+                response = send(*args, **kwargs)
+        except Exception:
+            self.record(endpoint, perf_counter() - start, bytes_sent=bytes_sent, error=True)
+            raise
+        latency = perf_counter() - start
+
+        status = response.status_code
+        if kwargs.get("stream"):
+            # don't read a streamed body here, that's up to the caller
+            bytes_received = int(response.headers.get("Content-Length") or 0)
+        else:
+            bytes_received = len(response.content)
+        self.record(endpoint, latency, status, bytes_sent, bytes_received,
+                    quota_error=status in QUOTA_STATUSES, error=status >= 400)
+        return response
+
+    def timed_execute(self, endpoint: str, request):
+        """
+        Executes a googleapiclient request (anything with .execute()) and records how long it took. HttpErrors are
+        inspected for Google's quota/rate limit reasons, and tagged with the endpoint (error.endpoint, so whoever
+        retries it can record the retry against it), before being re-raised. The status and response size come from
+        the HTTP response (httplib2 sets Content-Length to the decompressed size).
+        """
+        body = getattr(request, "body", None) or b""
+        responses = []
+        if hasattr(request, "add_response_callback"):
+            request.add_response_callback(responses.append)
+        start = perf_counter()
+        try:
+            with profiler.span("http " + endpoint):
+                result = request.execute()
+        except Exception as error:
+            latency = perf_counter() - start
+            status = getattr(getattr(error, "resp", None), "status", None)
+            content = getattr(error, "content", b"") or b""
+            self.record(endpoint, latency, status, len(body), len(content), quota_error=is_quota_error(error),
+                        error=True)
+            error.endpoint = endpoint
+            raise
+
+        latency = perf_counter() - start
+        status = responses[-1].status if responses else 200
+        bytes_received = sum(int(response.get("content-length") or 0) for response in responses)
+        self.record(endpoint, latency, status, len(body), bytes_received)
+        return result
+
+    def summary(self, current_sync: bool = False) -> dict:
+        """Returns a dictionary of per endpoint stats, plus totals, for everything or just the current sync."""
+        with self._lock:
+            all_endpoints, sync_counts = self.endpoints, self.sync_counts
+            if current_sync:
+                all_endpoints, sync_counts = self.current_endpoints, self.current_sync_counts
+            endpoints = {name: stats.as_dict() for name, stats in sorted(all_endpoints.items())}
+            sync_counts = dict(sync_counts)
+        totals = {
+            "calls": sum(stats["calls"] for stats in endpoints.values()),
+            "errors": sum(stats["errors"] for stats in endpoints.values()),
+            "retries": sum(stats["retries"] for stats in endpoints.values()),
+            "quota_errors": sum(stats["quota_errors"] for stats in endpoints.values()),
+            "bytes_received": sum(stats["bytes_received"] for stats in endpoints.values()),
+            "total_latency_s": round(sum(stats["total_latency_s"] for stats in endpoints.values()), 6),
+        }
+        return {"endpoints": endpoints, "totals": totals, "sync": sync_counts}
+
+    def summary_json(self, indent: int = 2, current_sync: bool = False) -> str:
+        """Returns summary() as a JSON string."""
+        return json.dumps(self.summary(current_sync), indent=indent)
+
+    def print_summary(self) -> None:
+        """Prints the JSON summary of the current sync, this is done at the end of every sync."""
+        print(f"{self.prefix} API call summary:\n{self.summary_json(current_sync=True)}")
+
+    def prometheus_text(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format."""
+        counters = (("g4s_api_calls_total", "calls"), ("g4s_api_errors_total", "errors"),
+                    ("g4s_api_retries_total", "retries"), ("g4s_api_quota_errors_total", "quota_errors"),
+                    ("g4s_api_bytes_sent_total", "bytes_sent"), ("g4s_api_bytes_received_total", "bytes_received"))
+        lines = []
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            for metric_name, attribute in counters:
+                lines.append(f"# TYPE {metric_name} counter")
+                for name, stats in endpoints:
+                    lines.append(f'{metric_name}{{endpoint="{name}"}} {getattr(stats, attribute)}')
+
+            lines.append("# TYPE g4s_api_latency_seconds histogram")
+            for name, stats in endpoints:
+                label = f'endpoint="{name}"'
+                cumulative = 0
+                for upper_bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(f'g4s_api_latency_seconds_bucket{{{label},le="{upper_bound}"}} {cumulative}')
+                lines.append(f'g4s_api_latency_seconds_bucket{{{label},le="+Inf"}} {stats.calls}')
+                lines.append(f"g4s_api_latency_seconds_sum{{{label}}} {stats.total_latency}")
+                lines.append(f"g4s_api_latency_seconds_count{{{label}}} {stats.calls}")
+        return "\n".join(lines) + "\n"
+
+
+# shared instance used by Go4Schools_API_Access.py
+metrics = api_metrics()
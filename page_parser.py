@@ -0,0 +1,65 @@
+"""Single pass extraction of the values Go4Schools embeds in its HTML pages (CSRF token, school ID, student ID etc.)"""
+
+import re
+
+# how much of the previous chunk is kept when reading the next, this must be longer than any single match
+CARRY_OVER_BYTES = 1024
+
+LOGIN_PAGE_PATTERNS = {
+    "__RequestVerificationToken": re.compile(rb'name="__RequestVerificationToken" type="hidden" value="([^"]*)"'),
+}
+
+STUDENT_PAGE_PATTERNS = {
+    "s_schoolID": re.compile(rb"var s_schoolID = ([^;]*);"),
+    "sid": re.compile(rb'\?sid=([^"]*)"'),
+    "accessToken": re.compile(rb'var accessToken = [^"]*"([^"]*)"'),
+}
+
+
+class page_parse_error(ValueError):
+    """
+    Raised when a Go4Schools page is missing values we need, which usually means Go4Schools has changed its layout.
+    """
+
+    def __init__(self, page_name: str, missing_fields: list):
+        self.page_name = page_name
+        self.missing_fields = missing_fields
+        super().__init__(f"Could not find {', '.join(missing_fields)} in the Go4Schools {page_name} page, the page "
+                         f"layout may have changed.")
+
+
+def extract_fields_from_chunks(chunks, patterns: dict, page_name: str = "") -> dict:
+    """
+    Searches an iterable of bytes chunks for every pattern in "patterns" (name -> compiled bytes regex with one group)
+    and returns {name: first match as a string}. Only the current chunk plus a small carry over from the previous one
+    is ever held in memory, and it stops reading as soon as every field has been found. Raises page_parse_error if
+    any field is still missing at the end of the page.
+    """
+    remaining = dict(patterns)
+    found = {}
+    carry = b""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buffer = carry + chunk
+        for name, pattern in list(remaining.items()):
+            match = pattern.search(buffer)
+            if match:
+                found[name] = match.group(1).decode("utf-8", "replace")
+                del remaining[name]
+        if not remaining:
+            return found
+        carry = buffer[-CARRY_OVER_BYTES:]
+
+    raise page_parse_error(page_name, list(remaining))
+
+
+def extract_fields(response, patterns: dict, page_name: str = "", chunk_size: int = 8192) -> dict:
+    """
+    Reads a requests response (ideally made with stream=True) once with extract_fields_from_chunks(), then closes it
+    so the rest of the page is never downloaded.
+    """
+    try:
+        return extract_fields_from_chunks(response.iter_content(chunk_size=chunk_size), patterns, page_name)
+    finally:
+        response.close()
@@ -0,0 +1,226 @@
+"""
+A memory bounded sync for many students: fetch -> normalise -> diff -> write stages connected by bounded queues. A
+stage that gets ahead blocks until the next one catches up (backpressure), so at most a few queues' worth of lessons
+are held in memory at once, however many students and weeks are synced, instead of every student's whole timetable
+being fetched before anything is written.
+
+Fetching and normalising run in their own threads. Diffing and writing both talk to Google through the same
+(not thread safe) httplib2 connection, so they are chained generators in the thread consuming the pipeline.
+
+Each student's googleapiclient service is a web of reference cycles (around a megabyte of parsed discovery
+document), which the garbage collector rarely gets round to, so it is closed and collected as soon as the writer has
+finished with that student, rather than piling up one per student.
+"""
+
+import gc
+import queue
+import threading
+from datetime import date, timedelta
+from time import perf_counter
+
+from instrumentation import metrics
+from profiling import profiler
+from transport import deadline, deadline_exceeded_error
+from sync import (CREATED, SKIPPED, FAILED, THROTTLED, FINISHED, KINDS, progress_event, retry_on_quota,
+                  call_with_quota_retries)
+
+# marks the end of a stage's output
+_DONE = object()
+
+
+class _stage_items(object):
+    """A bounded queue between two stages, whose put() and get() give up once the pipeline has been stopped."""
+
+    def __init__(self, size: int, stop: threading.Event):
+        self.queue = queue.Queue(maxsize=size)
+        self.stop = stop
+
+    def put(self, item) -> bool:
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self):
+        while not self.stop.is_set():
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+
+def _fetch(logins, start: date, weeks: int, include_homework: bool, request_deadline: deadline,
+           output: _stage_items) -> None:
+    """
+    Logs each student in, then fetches their timetable a week at a time (then their homework), passing on
+    (google_session, kind, title, item, error) one lesson or task at a time. A student who can't be logged in is
+    passed on as a single error, and the rest are still synced. Once request_deadline has passed, the students that
+    are left are passed on as a single error instead of being logged in.
+    """
+    for number, login in enumerate(logins, start=1):
+        if request_deadline is not None and request_deadline.expired():
+            error = deadline_exceeded_error(f"Deadline exceeded, students from student {number} on weren't synced.")
+            output.put((None, "login", f"student {number} onwards", None, error))
+            return
+        try:
+            with profiler.span("pipeline login"):
+                g4s, google_session = login(request_deadline)
+        except Exception as error:
+            if not output.put((None, "login", f"student {number} login", None, error)):
+                return
+            continue
+        for week in range(weeks):
+            week_start = start + timedelta(weeks=week)
+            try:
+                with profiler.span("pipeline fetch"):
+                    lessons = g4s.get_timetable(*g4s.format_date_range(week_start, week_start + timedelta(days=6)),
+                                                request_deadline)
+            except Exception as error:
+                if not output.put((google_session, "timetable", f"timetable from {week_start}", None, error)):
+                    return
+                continue
+            for lesson in lessons:
+                if not output.put((google_session, "lesson", str(lesson["subject_name"]), lesson, None)):
+                    return
+            del lessons
+        if include_homework:
+            try:
+                with profiler.span("pipeline fetch"):
+                    tasks = g4s.get_homework(request_deadline)
+            except Exception as error:
+                tasks = []
+                if not output.put((google_session, "homework", "homework", None, error)):
+                    return
+            for task in tasks:
+                if not output.put((google_session, "homework", task["title"], task, None)):
+                    return
+        del g4s, google_session
+
+
+def _normalise(source: _stage_items, output: _stage_items) -> None:
+    """Turns lessons and tasks into event bodies, passing on (google_session, title, body, error)."""
+    while (item := source.get()) is not _DONE:
+        google_session, kind, title, data, error = item
+        body = None
+        if error is None:
+            try:
+                with profiler.span("pipeline normalise"):
+                    if kind == "lesson":
+                        body = google_session.lesson_event_body(data)
+                    else:
+                        body = google_session.homework_event_body(data)
+            except Exception as normalise_error:
+                error = normalise_error
+        if not output.put((google_session, title, body, error)):
+            return
+
+
+def _diff(source: _stage_items, max_throttle_retries: int, throttle_backoff: float):
+    """Checks which events are already in the calendar, yielding (google_session, title, body, exists, error)."""
+    while (item := source.get()) is not _DONE:
+        google_session, title, body, error = item
+        exists = None
+        if error is None and body is not None:
+            def call():
+                with profiler.span("pipeline diff"):
+                    return google_session.event_body_exists(body)
+
+            try:
+                exists = call_with_quota_retries(call, max_throttle_retries, throttle_backoff)
+            except Exception as diff_error:
+                error = diff_error
+        yield google_session, title, body, exists, error
+
+
+def _release(google_session) -> None:
+    """Closes a student's Google session and collects the reference cycles its service leaves behind."""
+    if google_session is not None:
+        google_session.close()
+        gc.collect()
+
+
+def run_pipeline(logins, start: date, weeks: int, include_homework: bool = True, queue_size: int = 64,
+                 max_throttle_retries: int = 3, throttle_backoff: float = 2.0, request_deadline: deadline = None):
+    """
+    Syncs every student in "logins", an iterable of functions which log a student in and return their
+    (go4schools_session, google_calendar_session), for "weeks" weeks from "start", yielding the same progress_events
+    as sync.sync_events(). Students are only logged in when the pipeline gets to them, and a failed login is a
+    "failed" event rather than the end of the sync. The total isn't known up front, so it's always 0 and there is no
+    eta.
+
+    request_deadline (a transport.deadline) gives a scheduled run a time budget: it is passed to every login function
+    (which should pass it on to go4schools_session) and every Go4Schools request, and no more students are started
+    once it has passed. Events already fetched are still written.
+
+    If the consumer stops early (closes the generator), the fetching and normalising threads stop too.
+    """
+    metrics.begin_sync()
+    stop = threading.Event()
+    fetched, normalised = _stage_items(queue_size, stop), _stage_items(queue_size, stop)
+    errors = []
+
+    def stage(target, output: _stage_items, *args):
+        def run():
+            try:
+                target(*args, output)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                output.put(_DONE)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    threads = [stage(_fetch, fetched, logins, start, weeks, include_homework, request_deadline),
+               stage(_normalise, normalised, fetched)]
+
+    counts = dict.fromkeys(KINDS, 0)
+    started = perf_counter()
+    done = 0
+    current_session = None
+
+    def event(kind, title, error=None) -> progress_event:
+        if kind in counts:
+            counts[kind] += 1
+        return progress_event(kind, title, done, 0, dict(counts), perf_counter() - started, None, error)
+
+    try:
+        for google_session, title, body, exists, error in _diff(normalised, max_throttle_retries, throttle_backoff):
+            # students come through in order, so a new session means the writer is finished with the last one
+            if google_session is not current_session:
+                _release(current_session)
+                current_session = google_session
+            done += 1
+            if error is not None:
+                yield event(FAILED, title, error)
+            elif body is None or exists:
+                yield event(SKIPPED, title)
+            else:
+                def call():
+                    with profiler.span("pipeline write"):
+                        google_session.insert_event(body)
+
+                try:
+                    yield from retry_on_quota(call, max_throttle_retries, throttle_backoff,
+                                              lambda write_error: event(THROTTLED, title, write_error))
+                except Exception as write_error:
+                    yield event(FAILED, title, write_error)
+                else:
+                    yield event(CREATED, title)
+        _release(current_session)
+        current_session = google_session = None
+
+        for error in errors:
+            yield event(FAILED, "", error)
+        finished = event(FINISHED, "")
+        metrics.record_sync(finished.counts)
+        yield finished
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,128 @@
+"""
+A profiling mode for bug reports (python Go4Schools_API_Access.py --profile). The main thread runs under cProfile,
+and a sampling thread records the stacks of every thread (syncs run in background threads), so slow syncs and slow
+windows can both be explained. Named spans mark the stages (HTTP requests, JSON parsing, building tabs, calendar
+writes); their totals are summarised, and samples taken inside a span are grouped under it in the flame graph.
+
+The dump directory contains:
+- profile.pstats: cProfile stats for the main thread (python -m pstats, snakeviz, ...)
+- stacks.folded: collapsed stacks of every thread (flamegraph.pl, speedscope, ...)
+- spans.json: calls and total seconds of every named span
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class span_profiler(object):
+    """
+    Collects cProfile stats, stack samples and span timings between start() and stop(). When it isn't running,
+    span() does nothing, so spans can stay in the code permanently.
+    """
+
+    def __init__(self, sample_interval: float = 0.005):
+        self.prefix = "[Profile]"
+        self.sample_interval = sample_interval
+        self.enabled = False
+        self._profile = None
+        self._sampler = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stacks = Counter()
+        self._spans = {}  # span name: [calls, total seconds]
+        self._open_spans = {}  # thread ident: names of the spans that thread is inside, outermost first
+        self._started = None
+        self._elapsed = 0.0
+
+    def start(self) -> None:
+        """Starts profiling the calling thread (with cProfile) and sampling every thread."""
+        if self.enabled:
+            return
+        self.enabled = True
+        self._stop.clear()
+        self._started = perf_counter()
+        self._profile = cProfile.Profile()
+        self._sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._sampler.start()
+        self._profile.enable()
+
+    def stop(self) -> None:
+        if not self.enabled:
+            return
+        self._profile.disable()
+        self._stop.set()
+        self._sampler.join()
+        self._elapsed += perf_counter() - self._started
+        self.enabled = False
+
+    @contextmanager
+    def span(self, name: str):
+        """Times the with block as the named span (only while profiling)."""
+        if not self.enabled:
+            yield
+            return
+        open_spans = self._open_spans.setdefault(threading.get_ident(), [])
+        open_spans.append(name)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            open_spans.pop()
+            with self._lock:
+                stats = self._spans.setdefault(name, [0, 0.0])
+                stats[0] += 1
+                stats[1] += elapsed
+
+    def _sample(self) -> None:
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.sample_interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                spans = [f"span:{name}" for name in tuple(self._open_spans.get(ident, ()))]
+                self._stacks[";".join([thread_names.get(ident, str(ident))] + spans + frames[::-1])] += 1
+
+    def span_summary(self) -> dict:
+        """{span name: {"calls", "seconds"}}, slowest first."""
+        with self._lock:
+            spans = sorted(self._spans.items(), key=lambda item: item[1][1], reverse=True)
+        return {name: {"calls": calls, "seconds": round(seconds, 6)} for name, (calls, seconds) in spans}
+
+    def dump(self, directory: str = "g4s_profile") -> str:
+        """Writes profile.pstats, stacks.folded and spans.json to directory, and returns its path."""
+        os.makedirs(directory, exist_ok=True)
+        if self._profile is not None:
+            self._profile.dump_stats(os.path.join(directory, "profile.pstats"))
+        with open(os.path.join(directory, "stacks.folded"), "w") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(os.path.join(directory, "spans.json"), "w") as f:
+            json.dump({"seconds": round(self._elapsed, 6), "sample_interval": self.sample_interval,
+                       "spans": self.span_summary()}, f, indent=2)
+        return directory
+
+    def print_summary(self, top: int = 15) -> None:
+        """Prints the span totals and the functions with the most cumulative time in the main thread."""
+        print(f"{self.prefix} {self._elapsed:.2f}s profiled")
+        for name, stats in self.span_summary().items():
+            print(f"{self.prefix} {name}: {stats['calls']} calls, {stats['seconds']:.3f}s")
+        if self._profile is not None:
+            pstats.Stats(self._profile).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+
+
+# shared by everything, so one dump covers the whole program
+profiler = span_profiler()
@@ -0,0 +1,182 @@
+"""
+Parses Go4Schools grades and attendance into typed records and stores them in a local, indexed SQLite database, so
+cohort wide queries over several years run locally instead of through repeated API calls.
+"""
+
+import hashlib
+import json
+import sqlite3
+from typing import NamedTuple, Optional
+
+# Go4Schools doesn't document these responses, so each field is looked up under every name it has been seen under.
+# Records are only read from the arrays under these keys (at the top level, or inside a top level wrapper like
+# {"student_attendance": {"sessions": [...]}}), never from the settings and lookup tables sent alongside them.
+ATTENDANCE_ARRAY_KEYS = ("student_attendance", "attendance", "sessions", "attendance_sessions")
+GRADE_ARRAY_KEYS = ("student_grades", "grades", "student_grade_list", "grade_list")
+ATTENDANCE_DATE_KEYS = ("date", "session_date", "attendance_date")
+ATTENDANCE_SESSION_KEYS = ("session", "session_name", "am_pm", "period")
+ATTENDANCE_MARK_KEYS = ("mark", "code", "attendance_code", "mark_code")
+GRADE_SUBJECT_KEYS = ("subject_name", "subject", "subject_title")
+GRADE_TYPE_KEYS = ("grade_type_name", "grade_type", "type", "name")
+GRADE_VALUE_KEYS = ("grade", "value", "grade_value", "result")
+GRADE_DATE_KEYS = ("date", "grade_date", "last_updated", "updated_date")
+
+
+class attendance_record(NamedTuple):
+    student_id: str
+    school_id: str
+    academic_year: int
+    year_group: int
+    date: str
+    session: str
+    mark: str
+    entry_key: str  # the session, or a hash of raw for entries without one, so they can't overwrite each other
+    raw: str
+
+
+class grade_record(NamedTuple):
+    student_id: str
+    school_id: str
+    academic_year: int
+    year_group: int
+    subject: str
+    grade_type: str
+    grade: str
+    date: str
+    entry_key: str  # the date, or a hash of raw for grades without one, so they can't overwrite each other
+    raw: str
+
+
+def _first(entry: dict, keys: tuple) -> Optional[str]:
+    for key in keys:
+        if entry.get(key) not in (None, ""):
+            return str(entry[key])
+    return None
+
+
+def _records(data, array_keys: tuple) -> list[dict]:
+    """The entries of the record array in a parsed response (see ATTENDANCE_ARRAY_KEYS), or [] if there isn't one."""
+    if isinstance(data, list):
+        return [entry for entry in data if isinstance(entry, dict)]
+    for key in array_keys:
+        records = data.get(key) if isinstance(data, dict) else None
+        if isinstance(records, dict):
+            records = next((records[inner] for inner in array_keys if isinstance(records.get(inner), list)), None)
+        if isinstance(records, list):
+            return [entry for entry in records if isinstance(entry, dict)]
+    return []
+
+
+def _entry_key(key: str, raw: str) -> str:
+    """key, or a hash of the raw entry if it's empty, so entries without one are still told apart."""
+    return key or "raw:" + hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def parse_attendance(response_text: str, student_id: str, school_id: str, academic_year: int,
+                     year_group: int) -> list[attendance_record]:
+    """Turns go4schools_session.get_attendance() text into a list of attendance_records (one per marked session)."""
+    records = []
+    for entry in _records(json.loads(response_text), ATTENDANCE_ARRAY_KEYS):
+        date = _first(entry, ATTENDANCE_DATE_KEYS)
+        mark = _first(entry, ATTENDANCE_MARK_KEYS)
+        if date and mark:
+            session = _first(entry, ATTENDANCE_SESSION_KEYS) or ""
+            raw = json.dumps(entry, separators=(",", ":"), sort_keys=True)
+            records.append(attendance_record(student_id, school_id, int(academic_year), int(year_group), date[:10],
+                                             session, mark, _entry_key(session, raw), raw))
+    return records
+
+
+def parse_grades(response_text: str, student_id: str, school_id: str, academic_year: int,
+                 year_group: int) -> list[grade_record]:
+    """Turns go4schools_session.get_grades() text into a list of grade_records."""
+    records = []
+    for entry in _records(json.loads(response_text), GRADE_ARRAY_KEYS):
+        subject = _first(entry, GRADE_SUBJECT_KEYS)
+        grade = _first(entry, GRADE_VALUE_KEYS)
+        if subject and grade:
+            date = (_first(entry, GRADE_DATE_KEYS) or "")[:10]
+            raw = json.dumps(entry, separators=(",", ":"), sort_keys=True)
+            records.append(grade_record(student_id, school_id, int(academic_year), int(year_group), subject,
+                                        _first(entry, GRADE_TYPE_KEYS) or "", grade, date, _entry_key(date, raw), raw))
+    return records
+
+
+class records_store(object):
+    """
+    SQLite database of attendance and grade records. Rows are keyed by student, year and date/subject, so exporting
+    the same data again just replaces it rather than duplicating it.
+    """
+
+    def __init__(self, path: str = "g4s_records.sqlite3"):
+        self.prefix = "[Records]"
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS attendance (
+                student_id TEXT NOT NULL, school_id TEXT NOT NULL, academic_year INTEGER NOT NULL,
+                year_group INTEGER NOT NULL, date TEXT NOT NULL, session TEXT NOT NULL, mark TEXT NOT NULL,
+                entry_key TEXT NOT NULL, raw TEXT,
+                PRIMARY KEY (student_id, academic_year, date, entry_key)
+            );
+            CREATE INDEX IF NOT EXISTS attendance_cohort ON attendance (academic_year, year_group, date);
+            CREATE INDEX IF NOT EXISTS attendance_mark ON attendance (mark, academic_year);
+
+            CREATE TABLE IF NOT EXISTS grades (
+                student_id TEXT NOT NULL, school_id TEXT NOT NULL, academic_year INTEGER NOT NULL,
+                year_group INTEGER NOT NULL, subject TEXT NOT NULL, grade_type TEXT NOT NULL, grade TEXT NOT NULL,
+                date TEXT NOT NULL, entry_key TEXT NOT NULL, raw TEXT,
+                PRIMARY KEY (student_id, academic_year, subject, grade_type, entry_key)
+            );
+            CREATE INDEX IF NOT EXISTS grades_cohort ON grades (academic_year, year_group, subject);
+        """)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def add_attendance(self, records: list[attendance_record]) -> None:
+        """Writes attendance records in bulk, in a single transaction."""
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO attendance VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+
+    def add_grades(self, records: list[grade_record]) -> None:
+        """Writes grade records in bulk, in a single transaction."""
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO grades VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+
+    def attendance_summary(self, academic_year: int = None, year_group: int = None) -> list[tuple]:
+        """Returns (student_id, academic_year, mark, count) rows, optionally for one year and/or year group."""
+        return self.connection.execute("""
+            SELECT student_id, academic_year, mark, COUNT(*) FROM attendance
+            WHERE (:year IS NULL OR academic_year = :year) AND (:group IS NULL OR year_group = :group)
+            GROUP BY student_id, academic_year, mark ORDER BY student_id, academic_year, mark
+        """, {"year": academic_year, "group": year_group}).fetchall()
+
+    def grade_distribution(self, subject: str, academic_year: int = None, year_group: int = None) -> list[tuple]:
+        """Returns (academic_year, grade_type, grade, count) rows for a subject across the cohort."""
+        return self.connection.execute("""
+            SELECT academic_year, grade_type, grade, COUNT(*) FROM grades
+            WHERE subject = :subject AND (:year IS NULL OR academic_year = :year)
+              AND (:group IS NULL OR year_group = :group)
+            GROUP BY academic_year, grade_type, grade ORDER BY academic_year, grade_type, grade
+        """, {"subject": subject, "year": academic_year, "group": year_group}).fetchall()
+
+
+def export_history(g4s, store: records_store, years: dict) -> tuple:
+    """
+    Fetches a student's attendance and grades for every {academic_year: year_group} in "years" and writes them to
+    the store. Returns (number of attendance records, number of grade records).
+    """
+    attendance_count = grade_count = 0
+    for academic_year, year_group in sorted(years.items()):
+        attendance = parse_attendance(g4s.get_attendance(year_group, academic_year), g4s.student_id, g4s.SchoolID,
+                                      academic_year, year_group)
+        grades = parse_grades(g4s.get_grades(year_group, academic_year), g4s.student_id, g4s.SchoolID,
+                              academic_year, year_group)
+        store.add_attendance(attendance)
+        store.add_grades(grades)
+        attendance_count += len(attendance)
+        grade_count += len(grades)
+    print(f"{store.prefix} Stored {attendance_count} attendance and {grade_count} grade records in {store.path}.")
+    return attendance_count, grade_count
@@ -0,0 +1,128 @@
+"""Detects lessons which repeat every week, so they can be written to Google Calendar as one recurring event."""
+
+from collections import Counter
+from datetime import date, timedelta
+
+
+def _lesson_date(lesson: dict) -> date:
+    return date.fromisoformat(lesson["date"][:10])
+
+
+def _teachers(lesson: dict) -> tuple:
+    return tuple(sorted((lesson.get("teacher_list") or {}).values()))
+
+
+def compress_weekly_lessons(lessons: list[dict], min_occurrences: int = 2) -> tuple:
+    """
+    Splits a timetable (from go4schools_session.get_timetable()) into weekly series and standalone lessons.
+
+    Lessons with the same subject, group_code, weekday and start/end time are grouped together, and the most common
+    room and teacher of the group become the series' room and teacher. Returns (series, singles), where each series is
+    a dictionary of:
+    - series["lesson"]: the first lesson of the series, used for the title/description/times
+    - series["dates"]: the dates the series actually happens on
+    - series["exdates"]: the weeks between the first and last date where it doesn't happen, e.g. holidays, or weeks
+      where the room/teacher is different (those lessons are put in singles instead, as overrides)
+    and singles is a list of lessons which aren't part of any series (free periods are passed through too).
+    """
+    groups = {}
+    singles = []
+    for lesson in lessons:
+        if lesson.get("subject_name") in ["None", None]:
+            singles.append(lesson)
+            continue
+        key = (lesson["subject_name"], lesson.get("group_code"), _lesson_date(lesson).weekday(),
+               lesson["start_time"], lesson["end_time"])
+        groups.setdefault(key, []).append(lesson)
+
+    series = []
+    for group in groups.values():
+        usual_room_and_teachers = Counter((lesson.get("room_list"), _teachers(lesson)) for lesson in group)
+        usual = usual_room_and_teachers.most_common(1)[0][0]
+        regular = {}
+        overrides = []
+        for lesson in group:
+            if (lesson.get("room_list"), _teachers(lesson)) == usual and _lesson_date(lesson) not in regular:
+                regular[_lesson_date(lesson)] = lesson
+            else:
+                overrides.append(lesson)
+
+        if len(regular) < min_occurrences:
+            singles.extend(group)
+            continue
+
+        dates = sorted(regular)
+        series.append({"lesson": regular[dates[0]], "dates": dates, "exdates": weekly_exdates(dates)})
+        singles.extend(overrides)
+
+    return series, singles
+
+
+def weekly_exdates(dates) -> list[date]:
+    """The weeks between the first and last of "dates" (which are all the same weekday) that aren't in it."""
+    dates = sorted(dates)
+    present = set(dates)
+    exdates = []
+    week = dates[0]
+    while week <= dates[-1]:
+        if week not in present:
+            exdates.append(week)
+        week += timedelta(days=7)
+    return exdates
+
+
+def series_with_dates(series: dict, dates) -> dict:
+    """A copy of a series which happens on "dates" instead, with its lesson moved to the first of them."""
+    dates = sorted(dates)
+    lesson = series["lesson"]
+    return {"lesson": dict(lesson, date=dates[0].isoformat() + lesson["date"][10:]), "dates": dates,
+            "exdates": weekly_exdates(dates)}
+
+
+def recurrence_dates(first: date, recurrence: list[str]) -> list[date]:
+    """
+    The dates a weekly event starting on "first" happens on, read from the RRULE UNTIL and EXDATE lines written by
+    create_recurring_event_from_series().
+    """
+    until = first
+    excluded = set()
+    for line in recurrence:
+        if line.startswith("RRULE:") and "UNTIL=" in line:
+            until = date.fromisoformat(_compact_date(line.split("UNTIL=")[1]))
+        elif line.startswith("EXDATE"):
+            excluded.update(date.fromisoformat(_compact_date(value)) for value in line.split(":", 1)[1].split(","))
+    dates = []
+    week = first
+    while week <= until:
+        if week not in excluded:
+            dates.append(week)
+        week += timedelta(days=7)
+    return dates
+
+
+def _compact_date(value: str) -> str:
+    """ISO date of an iCalendar date or date-time, e.g. "20240603T090500" -> "2024-06-03"."""
+    return f"{value[:4]}-{value[4:6]}-{value[6:8]}"
+
+
+def merge_series(series: dict, existing_dates) -> dict:
+    """
+    A series plus the dates of an existing event for the same lesson that fall outside the weeks this series covers,
+    so syncing one range doesn't forget what an earlier sync of another (overlapping) range found. Inside this series'
+    weeks, it is the newer information.
+    """
+    first, last = series["dates"][0], series["dates"][-1]
+    dates = set(series["dates"]) | {existing for existing in existing_dates if not first <= existing <= last}
+    return series_with_dates(series, dates)
+
+
+def series_id(series: dict) -> str:
+    """
+    A stable ID for a series, stored on the Google event so it can be found again without scanning the calendar. It
+    only says which lesson the series is (subject, group, weekday and times), not which weeks it runs in, so a sync of
+    any range finds the event written by an earlier sync and merges into it.
+    """
+    lesson = series["lesson"]
+    parts = (lesson["subject_name"], lesson.get("group_code") or "", series["dates"][0].strftime("%a"),
+             lesson["start_time"], lesson["end_time"])
+    return "-".join(part.replace(" ", "_") for part in parts)
@@ -0,0 +1,98 @@
+"""
+The last timetable and homework fetched from Go4Schools, saved as gzipped JSON, so the GUI can show them straight away
+(even with no internet) and refresh them in the background.
+"""
+
+import gzip
+import json
+import os
+import threading
+from datetime import date, datetime
+
+from useful_functions import atomic_write, days_between
+
+SNAPSHOT_VERSION = 1
+
+
+class snapshot_store(object):
+    """
+    Lessons are saved per day, and every day of a fetched range is saved (days without lessons as empty lists), so
+    covers() can tell a day with no lessons apart from a day that was never fetched. Only one student's data is kept,
+    logging in as someone else starts a fresh snapshot.
+    """
+
+    def __init__(self, path: str = "g4s_snapshot.json.gz"):
+        self.prefix = "[Snapshot]"
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = None
+
+    def _load(self) -> dict:
+        if self._data is None:
+            self._data = {"version": SNAPSHOT_VERSION, "student_id": None, "timetable": {}, "homework": None,
+                          "saved_at": None}
+            if os.path.exists(self.path):
+                try:
+                    with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                        data = json.load(f)
+                    if data.get("version") == SNAPSHOT_VERSION:
+                        self._data = data
+                except (OSError, ValueError) as error:
+                    print(f"{self.prefix} Ignoring unreadable snapshot {self.path}: {error}")
+        return self._data
+
+    def _save(self) -> None:
+        self._data["saved_at"] = datetime.now().isoformat(timespec="seconds")
+        with atomic_write(self.path, "wt", gzip.open, encoding="utf-8") as f:
+            json.dump(self._data, f, separators=(",", ":"))
+
+    def exists(self) -> bool:
+        """True if there is a snapshot to show."""
+        with self._lock:
+            data = self._load()
+            return bool(data["timetable"]) or data["homework"] is not None
+
+    @property
+    def saved_at(self):
+        """When the snapshot was last saved (a datetime), or None."""
+        with self._lock:
+            saved_at = self._load()["saved_at"]
+        return datetime.fromisoformat(saved_at) if saved_at else None
+
+    def set_student(self, student_id: str) -> None:
+        """Starts a fresh snapshot if it belongs to a different student."""
+        with self._lock:
+            data = self._load()
+            if data["student_id"] != student_id:
+                self._data = {"version": SNAPSHOT_VERSION, "student_id": student_id, "timetable": {},
+                              "homework": None, "saved_at": None}
+
+    def save_timetable(self, lessons: list[dict], start: date, end: date) -> None:
+        """Saves the lessons fetched for start to end (inclusive, dates or datetimes), replacing those days."""
+        days = {day: [] for day in days_between(start, end)}
+        for lesson in lessons:
+            days.setdefault(lesson["date"][:10], []).append(lesson)
+        with self._lock:
+            self._load()["timetable"].update(days)
+            self._save()
+
+    def save_homework(self, tasks: list[dict]) -> None:
+        with self._lock:
+            self._load()["homework"] = tasks
+            self._save()
+
+    def covers(self, start: date, end: date) -> bool:
+        """True if every day from start to end has been saved."""
+        with self._lock:
+            timetable = self._load()["timetable"]
+            return all(day in timetable for day in days_between(start, end))
+
+    def lessons_between(self, start: date, end: date) -> list[dict]:
+        """The saved lessons from start to end (inclusive), in the order Go4Schools sent them."""
+        with self._lock:
+            timetable = self._load()["timetable"]
+            return [lesson for day in days_between(start, end) for lesson in timetable.get(day, [])]
+
+    def homework(self) -> list[dict]:
+        with self._lock:
+            return list(self._load()["homework"] or [])
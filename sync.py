@@ -0,0 +1,139 @@
+"""
+The sync core, as a generator of progress events. The GUI, the CLI and the metrics each consume the events at their
+own pace, instead of the sync being driven (and paced) by progress bar callbacks.
+"""
+
+import queue
+import threading
+from time import perf_counter, sleep
+from typing import NamedTuple, Optional
+
+from instrumentation import is_quota_error, metrics
+from profiling import profiler
+from recurrence import compress_weekly_lessons
+
+# kinds of progress event
+CREATED = "created"
+SKIPPED = "skipped"
+UPDATED = "updated"
+FAILED = "failed"
+THROTTLED = "throttled"
+FINISHED = "finished"
+KINDS = (CREATED, SKIPPED, UPDATED, FAILED, THROTTLED)
+
+
+class progress_event(NamedTuple):
+    """A single thing that happened during a sync, plus the sync's progress so far."""
+    kind: str
+    title: str
+    done: int
+    total: int
+    counts: dict
+    elapsed: float
+    eta: Optional[float]
+    error: Optional[Exception] = None
+
+    @property
+    def fraction(self) -> float:
+        return self.done / self.total if self.total else 1.0
+
+
+def lesson_jobs(google_session, lessons: list[dict], recurring: bool = False) -> list[tuple]:
+    """(create function, item, title) for every lesson, using recurring events for weekly lessons if asked to."""
+    jobs = []
+    if recurring:
+        series, lessons = compress_weekly_lessons(lessons)
+        jobs += [(google_session.create_recurring_event_from_series, lesson_series,
+                  lesson_series["lesson"]["subject_name"]) for lesson_series in series]
+    jobs += [(google_session.create_event_from_lesson_singular, lesson, str(lesson["subject_name"]))
+             for lesson in lessons]
+    return jobs
+
+
+def homework_jobs(google_session, tasks: list[dict]) -> list[tuple]:
+    """(create function, item, title) for every homework task."""
+    return [(google_session.create_event_from_homework_singular, task, task["title"]) for task in tasks]
+
+
+def retry_on_quota(call, max_throttle_retries: int = 3, throttle_backoff: float = 2.0, throttled=lambda error: error):
+    """
+    Calls call() and returns what it returns, retrying it after an exponential backoff while Google says we're over
+    quota, up to max_throttle_retries times. Anything else (or the last quota error) is raised. This is a generator
+    which yields throttled(error) before each backoff, so use it as "result = yield from retry_on_quota(...)". Each
+    retry is recorded against the endpoint which raised the quota error (see metrics.timed_execute()).
+    """
+    for attempt in range(max_throttle_retries + 1):
+        try:
+            return call()
+        except Exception as error:
+            if not is_quota_error(error) or attempt >= max_throttle_retries:
+                raise
+            yield throttled(error)
+            sleep(throttle_backoff * 2 ** attempt)
+            if getattr(error, "endpoint", None):
+                metrics.record_retry(error.endpoint)
+
+
+def call_with_quota_retries(call, max_throttle_retries: int = 3, throttle_backoff: float = 2.0):
+    """retry_on_quota(), for callers with nothing to report while backing off."""
+    retries = retry_on_quota(call, max_throttle_retries, throttle_backoff)
+    while True:
+        try:
+            next(retries)
+        except StopIteration as result:
+            return result.value
+
+
+def sync_events(jobs: list[tuple], max_throttle_retries: int = 3, throttle_backoff: float = 2.0):
+    """
+    Runs each (create function, item, title) job and yields a progress_event for it. The create functions return
+    "created", "skipped" or "updated". When Google says we're over quota, a "throttled" event is yielded and the job
+    is retried after a backoff, up to max_throttle_retries times before it counts as "failed". A final "finished"
+    event is yielded at the end.
+    """
+    metrics.begin_sync()
+    total = len(jobs)
+    counts = dict.fromkeys(KINDS, 0)
+    start = perf_counter()
+
+    def event(kind, title, done, error=None) -> progress_event:
+        if kind in counts:
+            counts[kind] += 1
+        elapsed = perf_counter() - start
+        eta = elapsed / done * (total - done) if done else None
+        return progress_event(kind, title, done, total, dict(counts), elapsed, eta, error)
+
+    for done, (create, item, title) in enumerate(jobs, start=1):
+        def call():
+            with profiler.span("sync " + create.__name__):
+                return create(item) or CREATED
+
+        try:
+            kind = yield from retry_on_quota(call, max_throttle_retries, throttle_backoff,
+                                             lambda error: event(THROTTLED, title, done - 1, error))
+        except Exception as error:
+            yield event(FAILED, title, done, error)
+        else:
+            yield event(kind, title, done)
+
+    finished = event(FINISHED, "", total)
+    metrics.record_sync(finished.counts)
+    yield finished
+
+
+def run_in_background(events) -> queue.Queue:
+    """
+    Consumes a progress event generator in a background thread, putting every event on the returned queue, so the
+    sync runs at full speed and the GUI can poll the queue whenever it repaints.
+    """
+    events_queue = queue.Queue()
+
+    def consume():
+        try:
+            for progress in events:
+                events_queue.put(progress)
+        except Exception as error:
+            events_queue.put(progress_event(FINISHED, "", 0, 0, {}, 0.0, None, error))
+
+    threading.Thread(target=consume, daemon=True).start()
+    return events_queue
@@ -0,0 +1,53 @@
+"""
+Turns Go4Schools lesson times into timezone aware ones. Go4Schools gives UK wall clock times with no offset (a date
+like "2024-01-08T00:00:00" and a time like "09:05"), which used to be sent to Google as "+00:00", so every lesson was
+an hour late during BST. The offsets come from zoneinfo, for Europe/London unless a time_zone is set in config.txt.
+"""
+
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+DEFAULT_TIME_ZONE = "Europe/London"
+
+# loaded on first use, as Windows needs the tzdata package installing first
+_time_zone = None
+
+
+def _zone() -> ZoneInfo:
+    global _time_zone
+    if _time_zone is None:
+        _time_zone = ZoneInfo(DEFAULT_TIME_ZONE)
+    return _time_zone
+
+
+def set_time_zone(name: str) -> None:
+    """Sets the zone lesson times are in. Raises zoneinfo.ZoneInfoNotFoundError if there is no such zone."""
+    global _time_zone
+    _time_zone = ZoneInfo(name)
+    local_datetime.cache_clear()
+
+
+def get_time_zone() -> str:
+    """The IANA name of the zone lesson times are in, for the "timeZone" of Google events and ICS TZIDs."""
+    return _zone().key
+
+
+@lru_cache(maxsize=4096)
+def local_datetime(day: str, time_text: str) -> datetime:
+    """
+    The aware datetime of time_text ("HH:MM") on day (anything starting "YYYY-MM-DD"). A timetable only has a handful
+    of lesson times per day, so these are cached per date and time rather than worked out for every lesson.
+    """
+    hour, minute = time_text.split(":")[:2]
+    return datetime(int(day[:4]), int(day[5:7]), int(day[8:10]), int(hour), int(minute), tzinfo=_zone())
+
+
+def local_iso(day: str, time_text: str) -> str:
+    """local_datetime() as an RFC 3339 string with the right offset, e.g. "2024-06-03T09:05:00+01:00"."""
+    return local_datetime(day, time_text).isoformat()
+
+
+def utc_stamp(day: str, time_text: str) -> str:
+    """local_datetime() in UTC, formatted for iCalendar, e.g. "20240603T080500Z"."""
+    return local_datetime(day, time_text).astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
@@ -0,0 +1,240 @@
+"""
+HTTP transport for the Go4Schools endpoints, with connect/read timeouts, retries with backoff for GETs, a circuit
+breaker which fails fast while Go4Schools is down, and deadlines so a whole sync can be given a time budget.
+"""
+
+import random
+import threading
+from json import loads, JSONDecodeError
+from time import monotonic, sleep
+
+import requests
+
+from instrumentation import metrics
+from profiling import profiler
+
+# statuses worth retrying, anything else >= 400 is returned to the caller as an error straight away
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# requests won't take a timeout of 0, and anything shorter than this can't get a response anyway
+MIN_TIMEOUT = 0.05
+
+
+class transport_error(Exception):
+    """Raised when Go4Schools returns an error status or something that isn't the JSON we asked for."""
+
+    def __init__(self, message: str, status_code: int = None):
+        self.status_code = status_code
+        super().__init__(message)
+
+
+class circuit_open_error(transport_error):
+    """Raised without sending anything while the circuit breaker is open (Go4Schools has been failing)."""
+
+
+class deadline_exceeded_error(transport_error, TimeoutError):
+    """Raised when a request can't be (re)tried because its deadline has passed."""
+
+
+class deadline(object):
+    """
+    A point in time that a whole sync has to be finished by. Pass the same deadline to every request in a sync, and
+    each request's timeouts and retries will be cut short so the sync finishes on time.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline, never negative."""
+        return max(0.0, self.expires_at - monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class circuit_breaker(object):
+    """
+    Counts consecutive failures, after "failure_threshold" of them the circuit "opens" and every request fails fast
+    for "reset_timeout" seconds. After that a single trial request is let through (half open), if it succeeds the
+    circuit closes again, otherwise it stays open for another "reset_timeout" seconds.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._trial_thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        """Returns True if a request may be sent right now."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                self._trial_thread = threading.get_ident()
+                return True
+            return False
+
+    def release_trial(self) -> None:
+        """
+        Lets another trial request through if the calling thread's trial request ended without a success or failure
+        being recorded, so the breaker can't get stuck open.
+        """
+        with self._lock:
+            if self._trial_thread == threading.get_ident():
+                self._trial_running = False
+                self._trial_thread = None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+            self._trial_thread = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            self._trial_thread = None
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = monotonic()
+
+
+# one breaker per host, shared by every session so all of them fail fast during an outage
+go4schools_breaker = circuit_breaker()
+
+
+class g4s_transport(object):
+    """
+    Sends requests to Go4Schools. GETs are retried up to "max_retries" times (with exponential backoff and jitter)
+    on connection errors, timeouts and the statuses in RETRY_STATUSES. Other methods (the login POST) are only retried
+    on a 429, as that means Go4Schools didn't process the request at all.
+
+    A requests.Session isn't thread safe, so requests from different threads (e.g. the GUI refreshing in the
+    background) are sent one at a time. Backoffs happen outside the lock.
+    """
+
+    def __init__(self, session: requests.Session = None, connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 max_retries: int = 3, backoff: float = 0.5, max_backoff: float = 8.0,
+                 breaker: circuit_breaker = None):
+        self.prefix = "[Transport]"
+        self.session = session or requests.Session()
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or go4schools_breaker
+        self._session_lock = threading.Lock()
+
+    def _timeout(self, endpoint: str, request_deadline: deadline = None) -> tuple:
+        """
+        (connect, read) timeouts, shortened if the deadline is closer than them. Raises deadline_exceeded_error if
+        there is less than MIN_TIMEOUT left.
+        """
+        connect_timeout, read_timeout = self.connect_timeout, self.read_timeout
+        if request_deadline is not None:
+            remaining = request_deadline.remaining()
+            if remaining < MIN_TIMEOUT:
+                raise deadline_exceeded_error(f"Deadline exceeded before {endpoint} could be fetched.")
+            connect_timeout, read_timeout = min(connect_timeout, remaining), min(read_timeout, remaining)
+        return max(connect_timeout, MIN_TIMEOUT), max(read_timeout, MIN_TIMEOUT)
+
+    def _backoff_delay(self, attempt: int, response: requests.Response = None) -> float:
+        """How long to wait before the next attempt, honours a Retry-After header if Go4Schools sends one."""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method: str, endpoint: str, url: str, request_deadline: deadline = None,
+                **kwargs) -> requests.Response:
+        """
+        Sends a request, retrying GETs, and returns the response. Raises transport_error (or one of its subclasses)
+        if it doesn't get a successful response.
+        """
+        idempotent = method.upper() == "GET"
+        attempts = self.max_retries + 1
+        send = getattr(self.session, method.lower())
+        last_error = None
+        for attempt in range(attempts):
+            try:
+                timeout = self._timeout(endpoint, request_deadline)
+            except deadline_exceeded_error as error:
+                raise error from last_error
+            if not self.breaker.allow_request():
+                raise circuit_open_error(f"Go4Schools is failing, not sending {endpoint} (circuit breaker open).")
+            if attempt:
+                metrics.record_retry(endpoint)
+
+            response = None
+            try:
+                with self._session_lock:
+                    response = metrics.timed_request(endpoint, send, url, timeout=timeout, **kwargs)
+            except requests.RequestException as error:
+                last_error = error
+                self.breaker.record_failure()
+                print(f"{self.prefix} {endpoint} failed ({error.__class__.__name__}), attempt {attempt + 1}.")
+                if not idempotent:
+                    break
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    # the server is up, even if it didn't like this particular request
+                    self.breaker.record_success()
+                    if response.status_code >= 400:
+                        response.close()
+                        raise transport_error(f"{endpoint} returned status {response.status_code}.",
+                                              response.status_code)
+                    return response
+                last_error = transport_error(f"{endpoint} returned status {response.status_code}.",
+                                             response.status_code)
+                if response.status_code != 429:
+                    self.breaker.record_failure()
+                response.close()
+                print(f"{self.prefix} {endpoint} returned {response.status_code}, attempt {attempt + 1}.")
+                if not idempotent and response.status_code != 429:
+                    break
+            finally:
+                # anything else escaping (or a 429) mustn't leave the half open trial slot taken
+                self.breaker.release_trial()
+
+            if attempt + 1 < attempts:
+                delay = self._backoff_delay(attempt, response)
+                if request_deadline is not None:
+                    delay = min(delay, request_deadline.remaining())
+                sleep(delay)
+
+        if isinstance(last_error, transport_error):
+            raise last_error
+        raise transport_error(f"{endpoint} failed after {attempt + 1} attempt(s): {last_error}") from last_error
+
+    def get(self, endpoint: str, url: str, request_deadline: deadline = None, **kwargs) -> requests.Response:
+        return self.request("GET", endpoint, url, request_deadline, **kwargs)
+
+    def post(self, endpoint: str, url: str, request_deadline: deadline = None, **kwargs) -> requests.Response:
+        return self.request("POST", endpoint, url, request_deadline, **kwargs)
+
+    def get_json(self, endpoint: str, url: str, request_deadline: deadline = None, **kwargs):
+        """GETs a URL and parses the JSON, raising transport_error if Go4Schools sent back something else."""
+        response = self.get(endpoint, url, request_deadline, **kwargs)
+        try:
+            with profiler.span("json " + endpoint):
+                return loads(response.text)
+        except JSONDecodeError:
+            raise transport_error(f"{endpoint} didn't return JSON (got {response.text[:80]!r}).",
+                                  response.status_code) from None
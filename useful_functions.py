@@ -1,5 +1,9 @@
 """Useful functions to use in Go4Schools_API_Access.py"""
 
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 from os import system
 from subprocess import check_call
 
@@ -12,3 +16,32 @@ def clear():
 def install(package):
     """Uses pip to install a package. This will error if 'pip' is not on %PATH%."""
     check_call(["pip", "install", package])
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w", opener=open, **kwargs):
+    """
+    Opens a uniquely named temporary file next to path (with opener, e.g. open or gzip.open) and replaces path with
+    it once the with block finishes, so nobody ever reads a half written file. If the block fails, path is left as it
+    was and the temporary file is deleted.
+    """
+    descriptor, temporary_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                                  dir=os.path.dirname(os.path.abspath(path)))
+    os.close(descriptor)
+    try:
+        with opener(temporary_path, mode, **kwargs) as f:
+            yield f
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def days_between(start: date, end: date) -> list[str]:
+    """The ISO dates from start to end (inclusive), which can be dates or datetimes."""
+    if isinstance(start, datetime):
+        start = start.date()
+    if isinstance(end, datetime):
+        end = end.date()
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]